@@ -0,0 +1,118 @@
+# coding=utf-8
+#
+# Throughput of the gcode monitors over a recorded OctoPrint serial.log - the old per pattern loop against the
+# hook prefilter + combined GcodeMatcher.
+#
+#   python benchmarks/gcode_matcher.py [--log benchmarks/data/serial.log] [--rounds 20]
+#
+from __future__ import absolute_import, print_function
+
+import argparse
+import os
+import re
+import sys
+import time
+
+basePath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(basePath, "..", "octoprint_toptemp"))
+import gcodematch
+
+# Ten "From printer" monitors and the predefined "GCode sent" monitors
+monitors = {
+    'gcIn' : {
+        'cu10' : r'(?:T|T0):.*? P:([^ ]+)',
+        'cu11' : r'(?:T|T0):.*? A:([^ ]+)',
+        'cu12' : r'^ok T:([^ ]+)',
+        'cu13' : r'B:([^ ]+)',
+        'cu14' : r'@:(\d+)',
+        'cu15' : r'B@:(\d+)',
+        'cu16' : r'^echo:.*?Z:([^ ]+)',
+        'cu17' : r'^FR:(\d+)%',
+        'cu18' : r'^E0 Flow: (\d+)%',
+        'cu19' : r'C:([^ ]+)',
+    },
+    'gcOut' : {
+        'cu1' : r'^M106.*?S([^ ]+)',
+        'cu2' : r'^M220 S([^ ]+)',
+        'cu3' : r'^M73.*?P(\d+)',
+        'cu4' : r'^G1 Z([^ ]+)',
+    }
+}
+
+logRe = re.compile(r' - (Send|Recv): (.*)$')
+sendRe = re.compile(r'^N\d+ (.*?)\*\d+$')
+
+
+# Lines as the comm hooks see them: [(type, line), ...]
+def loadLog(logFile):
+    lines = []
+    with open(logFile, "r") as fileHandle:
+        for logLine in fileHandle:
+            match = logRe.search(logLine.rstrip("\n"))
+            if not match:
+                continue
+            if match.group(1) == "Recv":
+                lines.append(('gcIn', match.group(2)))
+            else:
+                cmd = match.group(2)
+                sendMatch = sendRe.match(cmd)
+                if sendMatch:
+                    cmd = sendMatch.group(1)
+                # Same M107 handling as gCodeHandlerSent
+                if cmd.split(" ")[0] == "M107":
+                    cmd = "M106 S0"
+                lines.append(('gcOut', cmd))
+    return lines
+
+
+# The old gcodeRecvQworker loop - every line is queued and checked against every pattern
+def runLegacy(lines, compiled):
+    found = 0
+    for lineType, line in lines:
+        gcodeCmdLib = compiled[lineType]
+        for cKey in gcodeCmdLib:
+            dataStr = line.strip()
+            match = re.search(gcodeCmdLib[cKey], dataStr)
+            if match:
+                found += 1
+    return found
+
+
+# Prefilter in the hooks and one matcher per direction in the worker
+def runMatcher(lines, compiled):
+    prefilters = {lineType: gcodematch.buildPrefilter(compiled[lineType].values()) for lineType in compiled}
+    matchers = {lineType: gcodematch.GcodeMatcher(compiled[lineType]) for lineType in compiled}
+    found = 0
+    for lineType, line in lines:
+        prefixes = prefilters[lineType]
+        if prefixes is not None and not line.lstrip().startswith(prefixes):
+            continue
+        found += len(matchers[lineType].match(line.strip()))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default=os.path.join(basePath, "data", "serial.log"))
+    parser.add_argument("--rounds", type=int, default=20)
+    options = parser.parse_args()
+
+    lines = loadLog(options.log)
+    compiled = {lineType: {key: re.compile(monitors[lineType][key]) for key in monitors[lineType]} for lineType in monitors}
+    print("%d lines, %d gcIn and %d gcOut monitors, %d rounds" % (len(lines), len(compiled['gcIn']), len(compiled['gcOut']), options.rounds))
+    print("%-10s %10s %14s" % ("", "matches", "lines/s"))
+
+    results = {}
+    for name, func in (("legacy", runLegacy), ("matcher", runMatcher)):
+        start = time.time()
+        for i in range(options.rounds):
+            found = func(lines, compiled)
+        elapsed = time.time() - start
+        results[name] = elapsed
+        print("%-10s %10d %14.0f" % (name, found, len(lines) * options.rounds / elapsed))
+
+    print("speedup %.1fx" % (results["legacy"] / results["matcher"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,46 +2,111 @@
 from __future__ import absolute_import
 
 import octoprint.plugin
-from octoprint.util import RepeatedTimer
+from octoprint.events import Events
 from octoprint.access.permissions import Permissions, ADMIN_GROUP
 
 import os.path
 from os import path
 
 import glob
+import hashlib
+import json
+import platform
 import sys
 import flask
 import subprocess
 import psutil
 import re
 import threading
-import queue
 import time
 import math
 from flask_babel import gettext
 
+from . import sensors
+from .scheduler import MonitorScheduler, AdaptiveInterval
+from . import systeminfo
+from .systeminfo import PsutilSnapshot
+from .history import HistoryBuffer, encodeHistory, encodeValues, historyEncodings, createRollups, selectRollup
+from .messaging import MessageBatcher
+from . import gcodematch
+from . import postcalc
+from .downsample import DownsampleCache, downsampleMethods, downsample
+from .store import HistoryStore
+from .executor import CommandExecutor, CommandCache, signalProcessGroup
+from .multivalue import MultiValueParser, monitorKey, seriesKey
+from .stream import StreamManager
+from .onewire import W1Bus
+from .stats import RollingStats
+
 class TopTempPlugin(octoprint.plugin.StartupPlugin,
                        octoprint.plugin.SettingsPlugin,
                        octoprint.plugin.AssetPlugin,
                        octoprint.plugin.TemplatePlugin,
-                       octoprint.plugin.SimpleApiPlugin):
+                       octoprint.plugin.SimpleApiPlugin,
+                       octoprint.plugin.EventHandlerPlugin):
 
     def __init__(self):
-        # hold all running timers
-        self.timers = {}
-        # holds the history data
+        # one scheduler for all the periodic monitors
+        self.schedulerWorkers = 4
+        self.scheduler = MonitorScheduler(self.schedulerWorkers)
+        # holds the history data - a HistoryBuffer per custom monitor
         self.customHistory = {}
+        # min/max/mean rollups per custom monitor for long windows - see history.rollupTiers
+        self.customRollups = {}
+        # min/max/avg/stddev/rate per custom monitor over its gHisSecs window - see getMonitorStats
+        self.customStats = {}
+        # Downsampled history for the graphs - see getCustomHistory
+        self.downsampled = DownsampleCache()
+        # On disk copy of the history per custom monitor if persistHistory is enabled
+        self.historyStores = {}
+        # Monitors and settings saves can open/close stores at the same time
+        self.historyStoresLock = threading.Lock()
+        # persistHistory setting - read in configureHistoryStores/loadHistoryStores and not for every value
+        self.persistHistory = False
+        # Stores that could not be opened - not tried again until the settings are saved
+        self.historyStoresFailed = set()
         self.customMon = {}
+        # Compiled postCalc per custom monitor and the expressions they are compiled from
+        self.postCalcs = {}
+        self.postCalcExprs = {}
+        # Output parser per multi value monitor
+        self.multiParsers = {}
+        # [deadband, heartbeat] per monitor with a deadband - see passesDeadband
+        self.deadbands = {}
+        # AdaptiveInterval per monitor with adaptive intervals
+        self.adaptive = {}
+        # How often the host load is checked for loadBackoff
+        self.loadCheckInterval = 15
+        # Monitors paused due to waitForPrint/hideIfNoPrinter
+        self.pausedMons = set()
 
         # List of cpu temp methods found
         self.tempCmds = {}
-
-        self.psutilCPUHasRun = False
-
+        # Discovery of sensors and commands runs in the background - results are cached in detectedFile
+        self.discoveryLock = threading.Lock()
+        self.discoveryRunning = False
+        self.detectedFile = "detected.json"
+        # Resolved settings for getItems - see buildItemModel
+        self.itemModel = None
+        # Max time to wait for a candidate command when looking for cpu temp methods
+        self.discoveryTimeout = 5
+
+        # psutil data shared by all psutil monitors in the same tick
+        self.psutilSnap = PsutilSnapshot()
+
+        # default timeout for commands - cmd monitors has their own
         self.cmdTimeout = 30
-
-        # List of psu
-        self.psutilList = {
+        # runs the cmd monitors - max cmdConcurrency commands at the same time
+        self.cmdExecutor = CommandExecutor()
+        # monitors using the same command shares the result - see buildCommandTtls
+        self.cmdCache = CommandCache(self.runcommand)
+        # long running commands for stream monitors - every line is a value
+        self.streams = StreamManager(self.handleStreamLine)
+        # 1-Wire sensors are read together - see onewire.py
+        self.w1Bus = W1Bus()
+
+        # psutil options always available - buildPsuUtil adds the disks/sensors found to psutilList
+        self.psutilStatic = {
             'cpup'      : ['CPU usage %'],
             'cpuf'      : ['CPU frequency in MHz'],
             'loadavg1'  : ['Average system load last 1 minute'],
@@ -57,14 +122,26 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             'swapfree'  : ['Free swap memory in MB'],
             'swapperc'  : ['Free swap %']
         }
+        self.psutilList = dict(self.psutilStatic)
+        # Precompiled psutil readers by key - the static ones are ready before discovery, buildPsuUtil adds the rest
+        self.psutilReaders = self.staticPsutilReaders()
 
-        # Gcode handling
-        self.gcodeQue = queue.Queue()
+        # Gcode handling - bounded queue drained in batches by one worker
+        self.gcodeQue = gcodematch.GcodeLineQueue()
+        self.gcodeBatchSize = 100
         self.gcodeThread = None
         # Store all the actions to be handle for out/in gcode
         self.gcodeCmds = {'gcIn' : {}, 'gcOut':{}}
         self.gcodeCheckIn = False
         self.gcodeCheckOut = False
+        # Literal prefixes a line must start with to be queued - None means all lines
+        self.gcodePrefixIn = None
+        self.gcodePrefixOut = None
+        # Combined matchers used by the worker - rebuild when gcodeCmds changes
+        self.gcodeMatchers = {'gcIn' : gcodematch.GcodeMatcher({}), 'gcOut' : gcodematch.GcodeMatcher({})}
+
+        # Data sent to the frontend is collected and sent once per window
+        self.batcher = MessageBatcher(self.sendCustomBatch)
 
         # base config
         # customMon is all the custom monitoring items index by "customN" - a bit of a hackish way
@@ -81,6 +158,13 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             'sortOrder': ['bed','tool0','tool1','chamber','cu0'],
             'outerMargin': 4,
             'innerMargin': 8,
+            'pushWindow': 250,
+            'pushAllPoints': True,
+            'gcodeQueueSize': 1000,
+            'gcodeOverflow': 'dropOldest',
+            'persistHistory': False,
+            'cmdConcurrency': 2,
+            'loadBackoff': 0,
             'customMon': {}
         }
 
@@ -115,21 +199,38 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             'showSep' : False
         }
 
-        # type can be cmd, gcIn, gcOut, psutil
-        self.defaultsCustom = {'cmd':'','name':'','interval': 25, 'type':'cmd', 'isTemp' : True , 'waitForPrint' : False, 'hideIfNoPrinter': False, 'unit' : '', 'postCalc' : None}
+        # type can be cmd, gcIn, gcOut, psutil, sysfs, multi, stream
+        self.defaultsCustom = {'cmd':'','name':'','interval': 25, 'type':'cmd', 'isTemp' : True , 'waitForPrint' : False, 'hideIfNoPrinter': False, 'unit' : '', 'postCalc' : None, 'timeout' : 30, 'multiParser' : 'json', 'multiSeries' : '', 'deadband' : None, 'heartbeat' : 300, 'adaptive' : False, 'minInterval' : 5, 'maxInterval' : 120}
 
     # ----------------------------------------------------------------------------------------------------------------
     # Lets get started
     # ----------------------------------------------------------------------------------------------------------------
     def on_after_startup(self):
+        self.configureBatcher()
+        self.configureGcodeQueue()
+        self.configureExecutor()
+        self.batcher.start()
+        self.scheduler.start()
+        self.streams.start()
+        self.pausedMons = self.findIdleMonitors()
         self.initCustomMon()
         self.gcodeThread = threading.Thread(target=self.gcodeRecvQworker)
         self.gcodeThread.daemon = True
         self.gcodeThread.start()
         self._logger.info("TopTemp is initialized")
 
+    # Pause/resume monitors when the printer connects/disconnects or starts/stops printing
+    def on_event(self, event, payload):
+        if event in (Events.PRINTER_STATE_CHANGED, Events.CONNECTED, Events.DISCONNECTED):
+            self.updateMonitorPause()
+
     def on_shutdown(self):
-        pass
+        self.scheduler.shutdown()
+        self.streams.shutdown()
+        self.w1Bus.shutdown()
+        self.cmdExecutor.shutdown()
+        self.batcher.shutdown()
+        self.closeHistoryStores()
         # self.gcodeQue.join()
 
     # ----------------------------------------------------------------------------------------------------------------
@@ -155,9 +256,14 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
     # Fix dynamic default settings for custom monitoring and fix first run
     def on_settings_initialized(self):
-         # Get cpu options
-        self.checkCpuTempMethods()
-        self.buildPsuUtil()
+        # Get cpu options - from the cache if nothing has changed since last boot, else look in the background
+        # First run needs them now to find a cpu temperature monitor
+        if not self.loadDetected():
+            if self._settings.get(["firstRun"],merged=True,asdict=True) == False:
+                self.startDiscovery()
+            else:
+                self.discoveryRunning = True
+                self.runDiscovery()
 
         self.customMon = self._settings.get(["customMon"],merged=True,asdict=True)
 
@@ -221,7 +327,7 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
                 newCust = {'cu0':temp}
                 newCust['cu0']['cmd'] = self.tempCmds[key][0]
                 newCust['cu0']['name'] = 'CPU temperature'
-                newCust['cu0']['type'] = 'cmd'
+                newCust['cu0']['type'] = self.tempCmds[key][3]
                 newCust['cu0']['isTemp'] = True
                 newCust['cu0']['showTargetTemp'] = False
                 newCust['cu0']['label'] = "CPU:"
@@ -265,6 +371,10 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
         # Do we have custom data in the post?
         if 'customMon' not in data:
             octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+            self.configureBatcher()
+            self.configureGcodeQueue()
+            self.configureExecutor()
+            self.buildItemModel()
             return
 
         # Get old data to use
@@ -279,10 +389,16 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
             if 'delThis' in newData and newData['delThis'] == True:
                 # self._logger.info("Deleting: %s",ckey)
-                if ckey in self.timers:
+                if self.scheduler.removeJob(ckey):
                     self.debugOut("Stopping timer: " + ckey + " command is getting deleted")
-                    self.timers[ckey].cancel()
-                pass
+                if self.streams.remove(ckey):
+                    self.debugOut("Stopping stream: " + ckey + " command is getting deleted")
+                for gcType in ('gcIn','gcOut'):
+                    if ckey in self.gcodeCmds[gcType]:
+                        self.debugOut("Remove " + gcType + " for : " + ckey + " command is getting deleted")
+                        del self.gcodeCmds[gcType][ckey]
+                self.clearMonitorHistory(ckey)
+                self.cmdExecutor.remove(ckey)
             else:
                 if 'new' in newData and newData['new'] == True:
                     # self._logger.info("Creating new: %s",ckey)
@@ -292,13 +408,17 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
                     # New type
                     if 'type' in newData and custOld[ckey]['type'] != newData['type']:
                         # clean history if changing the typpe
-                        self.customHistory[ckey] = []
+                        self.clearMonitorHistory(ckey)
                         newMonCmd = True
                     # New command
                     if 'cmd' in newData and custOld[ckey]['cmd'] != newData['cmd']:
                         # clean history if changing the command
-                        self.customHistory[ckey] = []
+                        self.clearMonitorHistory(ckey)
                         newMonCmd = True
+                    # New series for multi value - the old ones are gone
+                    for multiKey in ('multiParser','multiSeries'):
+                        if multiKey in newData and custOld[ckey].get(multiKey) != newData[multiKey]:
+                            self.clearMonitorHistory(ckey)
                     # New interval
                     if 'interval' in newData and custOld[ckey]['interval'] != newData['interval']:
                         newMonCmd = True
@@ -309,9 +429,10 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             # Gcode
             if newMonCmd == True and (newCust[ckey]['type'] == "gcIn" or newCust[ckey]['type'] == "gcOut"):
                 # kill any running timers
-                if ckey in self.timers:
+                if self.scheduler.removeJob(ckey):
                     self.debugOut("Stopping timer: " + ckey + " type is no longer cmd")
-                    self.timers[ckey].cancel()
+                if self.streams.remove(ckey):
+                    self.debugOut("Stopping stream: " + ckey + " type is no longer stream")
 
                 self.debugOut("New gcode "+newCust[ckey]['type']+" mon needed: "+ckey + ":"+newCust[ckey]['cmd'])
                 self.createGCmon(ckey,newCust[ckey]['type'],newCust[ckey]['cmd'])
@@ -342,14 +463,55 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
         data['firstRun'] = False
         self.customMon = newCust.copy()
 
+        self.buildCommandTtls()
+        self.buildMultiParsers()
+        self.buildDeadbands()
+        self.buildAdaptive()
+        self.updateW1Sensors()
+
+        # Fit the history to the new settings and recalculate if the post calculation changed
+        oldCalcs = self.buildPostCalcs()
+        for key in list(self.customHistory):
+            mkey = monitorKey(key)
+            if mkey in self.customMon:
+                self.customHistory[key].resize(self.historyCapacity(key))
+                if oldCalcs.get(mkey) != self.postCalcExprs.get(mkey):
+                    self.debugOut("Post calculation changed for " + key + " - recalculating history")
+                    calc = self.postCalcs.get(mkey)
+                    self.customHistory[key].recalc(lambda raws: postcalc.applyPostCalc(calc,raws))
+                    # rollups and stats only has the calculated values - start over
+                    self.customRollups.pop(key,None)
+                    self.customStats.pop(key,None)
+                    self.writeHistoryStore(key)
+                elif key in self.historyStores and self.historyStores[key].capacity != self.customHistory[key].capacity:
+                    self.writeHistoryStore(key)
+            else:
+                del self.customHistory[key]
+                self.downsampled.remove(key)
+        for key in list(self.customRollups):
+            if monitorKey(key) not in self.customMon:
+                del self.customRollups[key]
+        for key in list(self.customStats):
+            if monitorKey(key) in self.customMon:
+                self.customStats[key].setWindow(self.statsWindow(key))
+            else:
+                del self.customStats[key]
+
         #Needed to write all the data
         octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
 
         # we need to force save customMon because of the way complex array/object are handled by on_settings_save
         self._settings.set(["customMon"],newCust,force=True)
 
-        # update gcode monitors
-        self.setGcodeMonNeed()
+        # Open or remove the history files
+        self.configureHistoryStores()
+
+        # update gcode monitors and paused state
+        self.updateMonitorPause(True)
+        self.configureBatcher()
+        self.configureGcodeQueue()
+        self.configureExecutor()
+        self.buildItemModel()
 
         return data
 
@@ -384,129 +546,245 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
         return returnDefault
 
-    def buildPsuUtil(self):
+    # ----------------------------------------------------------------------------------------------------------------
+    # Discovery of predefined options - the result is cached with a fingerprint of the hardware/software found so the
+    # next boot can skip it
+    # ----------------------------------------------------------------------------------------------------------------
+    def detectionFingerprint(self):
+        parts = [self._plugin_version or "", sys.platform, platform.release(), psutil.__version__]
+        for pattern in ('/sys/class/thermal/thermal_zone*','/sys/class/hwmon/hwmon*','/sys/bus/w1/devices/*'):
+            parts.extend(sorted(glob.glob(pattern)))
+        parts.extend(sorted(key for key in self.cpuTempCommands() if path.exists(key)))
+        parts.extend(partition.mountpoint for partition in psutil.disk_partitions())
+        if hasattr(psutil, "sensors_temperatures"):
+            parts.extend(sorted(psutil.sensors_temperatures()))
+        if hasattr(psutil, "sensors_fans"):
+            parts.extend(sorted(psutil.sensors_fans()))
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+    # Use the cached discovery - returns True if it is still valid. Outdated data is used until the refresh is done
+    def loadDetected(self):
+        filePath = os.path.join(self.get_plugin_data_folder(),self.detectedFile)
+        if not path.isfile(filePath):
+            return False
+        try:
+            with open(filePath, "r") as fileHandle:
+                detected = json.load(fileHandle)
+            self.tempCmds = detected['tempCmds']
+            self.buildPsuUtil(detected['psutil'])
+        except (IOError, OSError, ValueError, KeyError, TypeError, IndexError) as err:
+            self._logger.warning("Unable to read cached sensor discovery: %s",err)
+            return False
+        valid = detected.get('fingerprint') == self.detectionFingerprint()
+        self.debugOut("Loaded cached sensor discovery - valid: " + str(valid))
+        return valid
+
+    def saveDetected(self,detected):
+        filePath = os.path.join(self.get_plugin_data_folder(),self.detectedFile)
+        try:
+            with open(filePath + ".tmp", "w") as fileHandle:
+                json.dump(detected,fileHandle)
+            os.replace(filePath + ".tmp",filePath)
+        except (IOError, OSError) as err:
+            self._logger.warning("Unable to save sensor discovery: %s",err)
+
+    # Find all predefined options, cache them and tell the frontend
+    def runDiscovery(self):
+        self.debugOut("Looking for sensors")
+        try:
+            fingerprint = self.detectionFingerprint()
+            tempCmds = self.checkCpuTempMethods()
+            detectedPsutil = self.detectPsutil()
+            self.buildPsuUtil(detectedPsutil)
+            self.saveDetected({'fingerprint': fingerprint, 'tempCmds': tempCmds, 'psutil': detectedPsutil})
+            self._plugin_manager.send_plugin_message(self._identifier, dict(success=True,error=None,returnCode=0,result=None,cmds=self.tempCmds,psutil=self.psutilList,type="predefined"))
+        except Exception:
+            self._logger.exception("Looking for sensors failed")
+        finally:
+            with self.discoveryLock:
+                self.discoveryRunning = False
+
+    # Run discovery in the background - returns False if it is already running
+    def startDiscovery(self):
+        with self.discoveryLock:
+            if self.discoveryRunning:
+                return False
+            self.discoveryRunning = True
+        thread = threading.Thread(target=self.runDiscovery, name="TopTempDiscovery")
+        thread.daemon = True
+        thread.start()
+        return True
+
+    # Find the psutil sources available - returns what buildPsuUtil needs so it can be cached
+    def detectPsutil(self):
+        detected = {'partitions': [], 'temps': [], 'fans': [], 'battery': False}
+
+        # https://psutil.readthedocs.io/en/latest/#psutil.disk_partitions
+        detected['partitions'] = [partition.mountpoint for partition in psutil.disk_partitions()]
+
+        # temperatures and fans: [label, name, entryno]
+        for source, target in (("sensors_temperatures",'temps'),("sensors_fans",'fans')):
+            if not hasattr(psutil, source):
+                continue
+            sensorList = getattr(psutil, source)()
+            if not sensorList:
+                continue
+            count = 0
+            for name, entries in sensorList.items():
+                entryno = 0
+                for entry in entries:
+                    # shwtemp(label='', current=54.768, high=None, critical=None)
+                    if entry.label:
+                        label = entry.label
+                    else:
+                        label = name + "-" +str(count)
+                    detected[target].append([label,name,entryno])
+                    count += 1
+                    entryno += 1
+
+        # battery
+        if hasattr(psutil, "sensors_battery"):
+            detected['battery'] = bool(psutil.sensors_battery())
+        return detected
+
+    # Readers for the psutil options always available
+    def staticPsutilReaders(self):
+        readers = {}
+        for key in self.psutilStatic:
+            if key in systeminfo.staticReaders:
+                readers[key] = systeminfo.buildStaticReader(self.psutilSnap,key)
+        return readers
+
+    # Build the list of psutil options and a precompiled reader for each of them
+    def buildPsuUtil(self,detected=None):
         # Todo add network :)
         self.debugOut("Building psutil methods!")
-        # https://psutil.readthedocs.io/en/latest/#psutil.disk_partitions
-        partitions = [partition._asdict() for partition in psutil.disk_partitions()]
+        if detected is None:
+            detected = self.detectPsutil()
+        # Built from scratch and swapped in at the end - getPredefined and runPSUtil reads them at the same time
+        psutilList = dict(self.psutilStatic)
+        readers = self.staticPsutilReaders()
+
         count = 0
-        for partition in partitions:
-            self.psutilList['diskfree_'+str(count)] = ["Disk free \""+partition['mountpoint']+"\"",partition['mountpoint']]
-            self.psutilList['disktotal_'+str(count)] = ["Disk total \""+partition['mountpoint']+"\"",partition['mountpoint']]
-            self.psutilList['diskused_'+str(count)] = ["Disk used \""+partition['mountpoint']+"\"",partition['mountpoint']]
-            self.psutilList['diskperc_'+str(count)] = ["Disk used %  \""+partition['mountpoint']+"\"",partition['mountpoint']]
+        for mountpoint in detected['partitions']:
+            psutilList['diskfree_'+str(count)] = ["Disk free \""+mountpoint+"\"",mountpoint]
+            psutilList['disktotal_'+str(count)] = ["Disk total \""+mountpoint+"\"",mountpoint]
+            psutilList['diskused_'+str(count)] = ["Disk used \""+mountpoint+"\"",mountpoint]
+            psutilList['diskperc_'+str(count)] = ["Disk used %  \""+mountpoint+"\"",mountpoint]
+            for diskKey in systeminfo.diskReaders:
+                readers[diskKey+'_'+str(count)] = systeminfo.buildDiskReader(self.psutilSnap,diskKey,mountpoint)
             count += 1
 
         # temperatures
-        if hasattr(psutil, "sensors_temperatures"):
-            temps = psutil.sensors_temperatures()
-            if temps:
-                count = 0
-                for name, entries in temps.items():
-                    entryno = 0
-                    for entry in entries:
-                        # shwtemp(label='', current=54.768, high=None, critical=None)
-                        if entry.label:
-                            label = entry.label
-                        else:
-                            label = name + "-" +str(count)
-                        self.psutilList['temp_'+str(count)] = ["Temperature " + label,[name,entryno]]
-                        count += 1
-                        entryno += 1
+        for count, sensor in enumerate(detected['temps']):
+            psutilList['temp_'+str(count)] = ["Temperature " + sensor[0],[sensor[1],sensor[2]]]
+            readers['temp_'+str(count)] = systeminfo.buildSensorReader(self.psutilSnap,"sensors_temperatures",sensor[1],sensor[2])
+
         # fans
-        if hasattr(psutil, "sensors_fans"):
-            fans = psutil.sensors_fans()
-            if fans:
-                count = 0
-                for name, entries in fans.items():
-                    entryno = 0
-                    for entry in entries:
-                        if entry.label:
-                            label = entry.label
-                        else:
-                            label = name + "-" +str(count)
-                        self.psutilList['fanspeed_'+str(count)] = ["Fanspeed \"" + label + "\" RPM",[name,entryno]]
-                        count += 1
-                        entryno += 1
+        for count, sensor in enumerate(detected['fans']):
+            psutilList['fanspeed_'+str(count)] = ["Fanspeed \"" + sensor[0] + "\" RPM",[sensor[1],sensor[2]]]
+            readers['fanspeed_'+str(count)] = systeminfo.buildSensorReader(self.psutilSnap,"sensors_fans",sensor[1],sensor[2])
 
         # battery
-        if hasattr(psutil, "sensors_battery"):
-            battery = psutil.sensors_battery()
-            if battery:
-                self.psutilList['batper'] = ["Battery power left %"]
-                self.psutilList['batsec'] = ["Battery power left seconds"]
+        if detected['battery']:
+            psutilList['batper'] = ["Battery power left %"]
+            psutilList['batsec'] = ["Battery power left seconds"]
+            readers['batper'] = systeminfo.buildStaticReader(self.psutilSnap,'batper')
+            readers['batsec'] = systeminfo.buildStaticReader(self.psutilSnap,'batsec')
 
-        self.debugOut(self.psutilList)
+        self.psutilList = psutilList
+        self.psutilReaders = readers
+        self.debugOut(psutilList)
+        return readers
 
     # ----------------------------------------------------------------------------------------------------------------
     # check the available methods for finding CPU temp on the hw platform
     # ----------------------------------------------------------------------------------------------------------------
+    # Candidate commands for the cpu temperature: path that must exist : [command, name, value, type]
+    def cpuTempCommands(self):
+        return {
+            '/opt/vc/bin/vcgencmd' :
+                [
+                    '/opt/vc/bin/vcgencmd measure_temp|cut -d "=" -f2|cut -d"\'" -f1',
+                    "CPU vcgencmd 1",
+                    None,
+                    'cmd'
+                ],
+            '/usr/bin/vcgencmd' :
+                [
+                    '/usr/bin/vcgencmd measure_temp|cut -d "=" -f2|cut -d"\'" -f1',
+                    "CPU vcgencmd 2",
+                    None,
+                    'cmd'
+                ],
+            '/usr/bin/acpi' :
+                [
+                    '/usr/bin/acpi -t |cut -d "," -f2| cut -d" " -f2',
+                    "CPU ACPI",
+                    None,
+                    'cmd'
+                ],
+        }
+
+    # The list of cpu temp methods is build into a new dict and replaced when done - it runs in the background
     def checkCpuTempMethods(self):
-        self.tempCmds = {}
+        tempCmds = {}
 
         self.debugOut("Building cpu methods!")
 
         # build list for linux
         if sys.platform.startswith("linux"):
-            self.tempCmds = {
-                '/opt/vc/bin/vcgencmd' :
-                    [
-                        '/opt/vc/bin/vcgencmd measure_temp|cut -d "=" -f2|cut -d"\'" -f1',
-                        "CPU vcgencmd 1",
-                        None
-                    ],
-                '/usr/bin/vcgencmd' :
-                    [
-                        '/usr/bin/vcgencmd measure_temp|cut -d "=" -f2|cut -d"\'" -f1',
-                        "CPU vcgencmd 2",
-                        None
-                    ],
-                '/usr/bin/acpi' :
-                    [
-                        '/usr/bin/acpi -t |cut -d "," -f2| cut -d" " -f2',
-                        "CPU ACPI",
-                        None
-                    ],
-            }
-
+            # Native sysfs sources first so they are preferred over forking a shell
             # try and find thermal class by looking cpu-thermal temp
-            code, out, err = self.runcommand("for i in /sys/class/thermal/thermal_zone*; do if grep -qi cpu-thermal $i/type && test -f $i/temp ; then echo $i/temp;exit 0; fi; done; exit 1")
-            if not code and not err:
-                self.tempCmds[out] = ["awk '{print $0/1000}' "+out,'CPU thermal zone',None]
-
-            # look for DS18B20 devices
-            DS18B20s = glob.glob('/sys/bus/w1/devices/28-*')
-            if DS18B20s:
-                for DS18B20 in DS18B20s:
-                    #check slave is present /w1_slave
-                    dsslave = os.path.join(DS18B20,'w1_slave')
-                    if os.path.isfile(dsslave):
-                        dsbase = os.path.basename(DS18B20)
-                        # check for crc
-                        code, out, err = self.runcommand("grep -iqP \"crc=(.*)YES\" "+dsslave)
-                        if not code and not err:
-                            self.tempCmds[DS18B20] = ["awk -F'[ =]' '$10==\"t\"{printf(\"%.2f\\n\",$11/1000)}' "+dsslave,'DS18B20 sensor ('+dsbase+')' ,None]
+            for zone in sensors.findThermalZones():
+                tempCmds[zone[0]] = [zone[0],'CPU thermal zone',None,'sysfs']
+
+            # hwmon temperature inputs from known cpu chips
+            for hwmon in sensors.findHwmonSensors(True):
+                tempCmds[hwmon[0]] = [hwmon[0],'hwmon '+hwmon[1],None,'sysfs']
+
+            tempCmds.update(self.cpuTempCommands())
+
+            # Other hwmon sensors (drives, wifi, psu...) are listed after the cpu commands
+            for hwmon in sensors.findHwmonSensors(False):
+                tempCmds[hwmon[0]] = [hwmon[0],'hwmon '+hwmon[1],None,'sysfs']
+
+            # look for DS18B20 devices - all read at the same time, crc is checked when reading
+            w1Values = self.w1Bus.readAll()
+            for dsslave in self.w1Bus.devices():
+                tempCmds[dsslave[0]] = [dsslave[0],'DS18B20 sensor ('+dsslave[1]+')',w1Values.get(dsslave[0]),'sysfs']
 
         # check all methods found
-        for key in self.tempCmds:
+        for key in tempCmds:
             if (path.exists(key)):
-                # self._logger.debug(self.tempCmds[key])
-                code, out, err = self.runcommand(self.tempCmds[key][0])
+                # self._logger.debug(tempCmds[key])
+                if tempCmds[key][3] == "sysfs":
+                    # 1-Wire already read
+                    if tempCmds[key][2] is not None:
+                        continue
+                    try:
+                        tempCmds[key][2] = sensors.readSysfsValue(tempCmds[key][0])
+                    except (IOError, OSError, ValueError) as err:
+                        self._logger.debug("ERROR 3:-------------------------------------------------------------%s %s",key,err)
+                    continue
+
+                code, out, err = self.runcommand(tempCmds[key][0],self.discoveryTimeout)
                 out = out.rstrip("\n")
                 if code or err:
                     # self._logger.debug("ERROR 1:-------------------------------------------------------------%s %s",err,code)
                     pass
                 else:
                     if self.checkStringIsVal(out):
-                        # self._logger.debug("OK-------------------------------------------------------------%s %s",out,self.tempCmds[key][0])
-                        self.tempCmds[key][2] = float(out)
+                        # self._logger.debug("OK-------------------------------------------------------------%s %s",out,tempCmds[key][0])
+                        tempCmds[key][2] = float(out)
                     else:
                         self._logger.debug("ERROR 2:-------------------------------------------------------------%s",out)
                         pass
             else:
                 self._logger.debug("Not found:-------------------------------------------------------------%s",key)
 
-
+        self.tempCmds = tempCmds
+        return tempCmds
 
     # ----------------------------------------------------------------------------------------------------------------
     # Start custom monitors
@@ -514,12 +792,24 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
         customMon = self._settings.get(['customMon'],merged=True,asdict=True)
 
         # stop old timers if someone is calling us
-        for timer in self.timers:
-            self.timers[timer].cancel()
+        self.scheduler.clear()
+        self.streams.clear()
 
         # cleanup all
-        self.timers = {}
+        self.gcodeCmds = {'gcIn' : {}, 'gcOut':{}}
         self.customHistory = {}
+        self.customRollups = {}
+        self.customStats = {}
+        self.downsampled.clear()
+        self.buildPostCalcs()
+        self.buildCommandTtls()
+        self.buildMultiParsers()
+        self.buildDeadbands()
+        self.buildAdaptive()
+        self.updateW1Sensors()
+
+        # Get the stored history back before the monitors starts adding to it
+        self.loadHistoryStores()
 
         # setup all the monitors
         for mon in customMon:
@@ -533,19 +823,68 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
                     self.createTimer(mon,int(customMon[mon]['interval']),str(customMon[mon]['cmd']),customMon[mon]['type'])
 
         self.setGcodeMonNeed()
-
-    # Timer for custom bash command
+        self.scheduler.addJob("loadCheck",self.loadCheckInterval,self.checkHostLoad,[])
+
+    # Compile the post calculations for all custom monitors - returns the previous expressions
+    def buildPostCalcs(self):
+        oldCalcs = self.postCalcExprs
+        self.postCalcs = {}
+        self.postCalcExprs = {}
+        for key in self.customMon:
+            expression = self.customMon[key].get('postCalc')
+            # Only used for non temperature monitors
+            if self.customMon[key].get('isTemp') or expression is None or str(expression).strip() == "":
+                continue
+            try:
+                self.postCalcs[key] = postcalc.compilePostCalc(expression)
+                self.postCalcExprs[key] = str(expression).strip()
+            except ValueError as err:
+                self._logger.warning("Invalid post calculation for %s: \"%s\" - %s",key,expression,err)
+        return oldCalcs
+
+    # Schedule a custom monitor - replaces any existing job for the same index
     def createTimer(self,indx,interval,cmd,cmdtype):
-        if indx in self.timers:
-            self.debugOut("Stopping timer: " + indx)
-            self.timers[indx].cancel()
-
+        if indx in self.adaptive:
+            interval = self.adaptive[indx].interval
         self.debugOut("Setting up custom timer for \"" + cmd + "("+indx+" / "+cmdtype+") running each " + str(interval) + " seconds")
+        paused = indx in self.pausedMons
+        # Streams are started once and not scheduled
+        if cmdtype == "stream":
+            self.scheduler.removeJob(indx)
+            self.streams.add(indx,cmd,paused)
+            return
+        self.streams.remove(indx)
         if cmdtype == "cmd":
-            self.timers[indx] = RepeatedTimer(interval,self.runCustomMon, run_first=True,args=[indx,cmd])
+            self.scheduler.addJob(indx,interval,self.runCustomMon,[indx,cmd],paused)
+        elif cmdtype == "sysfs":
+            self.scheduler.addJob(indx,interval,self.runSysfs,[indx,cmd],paused)
+        elif cmdtype == "multi":
+            self.scheduler.addJob(indx,interval,self.runMultiMon,[indx,cmd],paused)
         else:
-            self.timers[indx] = RepeatedTimer(interval,self.runPSUtil, run_first=True,args=[indx,cmd])
-        self.timers[indx].start()
+            self.scheduler.addJob(indx,interval,self.runPSUtil,[indx,cmd],paused)
+
+    # Monitors that should not run right now: waitForPrint and not printing or hideIfNoPrinter and not connected
+    def findIdleMonitors(self):
+        printing = self._printer.is_printing()
+        operational = self._printer.is_operational()
+        idle = set()
+        for key in self.customMon:
+            mon = self.customMon[key]
+            if (mon.get('waitForPrint') and not printing) or (mon.get('hideIfNoPrinter') and not operational):
+                idle.add(key)
+        return idle
+
+    # Pause/resume scheduled and gcode monitors after the printer state or settings changed
+    def updateMonitorPause(self,force=False):
+        idle = self.findIdleMonitors()
+        if idle == self.pausedMons and not force:
+            return
+        self.debugOut("Paused monitors: " + str(idle))
+        self.pausedMons = idle
+        for key in self.customMon:
+            self.scheduler.setPaused(key,key in idle)
+            self.streams.setPaused(key,key in idle)
+        self.setGcodeMonNeed()
 
     def createGCmon(self,indx,ctype,pattern):
         self.debugOut("Setting up custom gcode monitor for \""+indx+"\". Type: " + ctype + " pattern: " +pattern)
@@ -564,197 +903,511 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
         self.gcodeCmds[ctype][indx] = re.compile(pattern)
 
     def setGcodeMonNeed(self):
-        if self.gcodeCmds['gcIn']:
+        # Paused monitors are left out
+        activeIn = {key: pattern for key, pattern in self.gcodeCmds['gcIn'].items() if key not in self.pausedMons}
+        activeOut = {key: pattern for key, pattern in self.gcodeCmds['gcOut'].items() if key not in self.pausedMons}
+
+        # Matchers and prefilters must be ready before the checks are turned on
+        self.gcodeMatchers = {
+            'gcIn' : gcodematch.GcodeMatcher(activeIn),
+            'gcOut' : gcodematch.GcodeMatcher(activeOut)
+        }
+        self.gcodePrefixIn = gcodematch.buildPrefilter(activeIn.values())
+        self.gcodePrefixOut = gcodematch.buildPrefilter(activeOut.values())
+        self.debugOut("gcode prefilters in: " + str(self.gcodePrefixIn) + " out: " + str(self.gcodePrefixOut))
+
+        if activeIn:
             self.gcodeCheckIn = True
         else:
             self.gcodeCheckIn = False
 
-        if self.gcodeCmds['gcOut']:
+        if activeOut:
             self.gcodeCheckOut = True
         else:
             self.gcodeCheckOut = False
 
-    # Trigger by the timer
+    # Trigger by the timer - the command is run by the executor, skipped if the last run is not done yet
     def runCustomMon(self,indx,cmd):
-        code, out, err = self.runcommand(cmd)
+        if not self.cmdExecutor.submit(indx,self.cmdCache.run,[cmd,self.monitorTimeout(indx)],lambda result: self.handleCommandResult(indx,cmd,result)):
+            self.debugOut(cmd + "("+indx+") is still running - skipping")
+
+    # A command result can be reused for half the shortest interval of the monitors using it
+    def buildCommandTtls(self):
+        ttls = {}
+        for key in self.customMon:
+            mon = self.customMon[key]
+            if mon.get('type') not in ("cmd","multi") or not mon.get('cmd'):
+                continue
+            ttl = self.shortestInterval(mon)/2.0
+            cmd = str(mon['cmd'])
+            if cmd not in ttls or ttl < ttls[cmd]:
+                ttls[cmd] = ttl
+        self.cmdCache.setTtls(ttls)
+
+    # Timeout in seconds for a cmd monitor
+    def monitorTimeout(self,indx):
+        try:
+            timeout = float(self.customMon[indx].get('timeout') or self.cmdTimeout)
+        except (KeyError, TypeError, ValueError):
+            timeout = self.cmdTimeout
+        return max(timeout,1)
+
+    def handleCommandResult(self,indx,cmd,result):
+        code, out, err = result
         self.debugOut(cmd + "("+indx+") returned: " +out + " for index :"+indx)
         if code or err:
-            self.debugOut(cmd + " failed with code: " + code + " error: " + err)
+            self.debugOut(cmd + " failed with code: " + str(code) + " error: " + err)
             self._plugin_manager.send_plugin_message(self._identifier, dict(success=False,error=err,returnCode=code,result=None,key=indx,type="custom"))
         else:
             self.handleCustomData(indx,out,time.time())
 
-    # Trigger by the timer
-    def runPSUtil(self,indx,cmd,returnData = False):
-        # 'cpup'      : ['CPU usage percentage'],
-        # 'cpuf'      : ['CPU frequency in GHz'],
-        # 'loadavg1'  : ['Average system load last 1 minute'],
-        # 'loadavg5'  : ['Average system load last 5 minutes'],
-        # 'loadavg15' : ['Average system load last 15 minutes'],
-        # 'memtotal'  : ['Total physical memory (exclusive swap)'],
-        # 'memavail'  : ['Total available memory'],
-        # 'memused'   : ['Memory used'],
-        # 'memfree'   : ['Memory not being used at all'],
-        # 'memp'      : ['Memory free percentage'],
-        # 'swaptotal' : ['Total swap memory'],
-        # 'swapused'  : ['Used swap memory'],
-        # 'swapfree'  : ['Free swap memory'],
-        # 'swapperc'  : ['Free swap percentage']
-        #  Icons to the above
-        # <i class="fas fa-microchip"></i>
-        # <i class="fas fa-microchip"></i>
-        # <i class="fas fa-tachometer-alt"></i>
-        # <i class="fas fa-tachometer-alt"></i>
-        # <i class="fas fa-tachometer-alt"></i>
-        # <i class="fas fa-memory"></i>
-        # <i class="fas fa-memory"></i>
-        # <i class="fas fa-memory"></i>
-        # <i class="fas fa-memory"></i>
-        # <i class="fas fa-memory"></i>
-        # exchange-alt
-        #
-        # disk: <i class="fas fa-hdd"></i>
-        # temp: <i class="fas fa-thermometer-half"></i>
-        # fan: <i class="fas fa-fan"></i>
-        # battery: <i class="fas fa-battery-half"></i>
-        # self.psutilList['diskfree_'+str(count)] = ["Disk free "+partition['mountpoint'],partition['mountpoint']]
-        # self.psutilList['disktotal_'+str(count)] = ["Disk total "+partition['mountpoint'],partition['mountpoint']]
-        # self.psutilList['diskused_'+str(count)] = ["Disk used "+partition['mountpoint'],partition['mountpoint']]
-        # self.psutilList['diskperc_'+str(count)] = ["Disk used percent "+partition['mountpoint'],partition['mountpoint']]
-        # self.psutilList['temp_'+str(count)] = ["Temperature " + label,[name,entryno]]
-        # self.psutilList['fanspeed_'+str(count)] = ["Fanspeed " + label,[name,entryno]]
-        # self.psutilList['batper'] = ["Battery power left percentage"]
-        # self.psutilList['batsec'] = ["Battery power left seconds"]
+    # Trigger by the timer - multi value commands runs like cmd monitors but the output feeds several series
+    def runMultiMon(self,indx,cmd):
+        if not self.cmdExecutor.submit(indx,self.cmdCache.run,[cmd,self.monitorTimeout(indx)],lambda result: self.handleMultiResult(indx,cmd,result)):
+            self.debugOut(cmd + "("+indx+") is still running - skipping")
+
+    def handleMultiResult(self,indx,cmd,result):
+        code, out, err = result
+        if code or err:
+            self.debugOut(cmd + " failed with code: " + str(code) + " error: " + err)
+            self._plugin_manager.send_plugin_message(self._identifier, dict(success=False,error=err,returnCode=code,result=None,key=indx,type="custom"))
+            return
+        parser = self.multiParsers.get(indx)
+        if parser is None:
+            return
+        values = parser.parse(out)
+        if not values:
+            self.debugOut("Got BAD multi value data for "+indx+": " + out)
+            return
+        now = time.time()
+        # The main series is the value of the monitor - series missing from this run are just left out
+        for name in values:
+            self.handleCustomData(indx if name == parser.mainSeries else seriesKey(indx,name),values[name],now)
+
+    # 1-Wire sensors used by monitors - only these are read in a bus pass
+    def updateW1Sensors(self):
+        self.w1Bus.setWanted([str(mon['cmd']) for mon in self.customMon.values() if mon.get('type') == "sysfs" and os.path.basename(str(mon.get('cmd'))) == "w1_slave"])
+
+    # Parsers for all multi value monitors
+    def buildMultiParsers(self):
+        self.multiParsers = {}
+        for key in self.customMon:
+            mon = self.customMon[key]
+            if mon.get('type') != "multi":
+                continue
+            try:
+                self.multiParsers[key] = MultiValueParser(mon.get('multiParser'),mon.get('multiSeries'))
+            except ValueError as err:
+                self._logger.warning("Invalid series for %s: %s",key,err)
+
+    # Blank deadband is off - else a value is only stored and sent if it moved more than the deadband from the last
+    # stored value or heartbeat seconds has passed since it (0 for no heartbeat)
+    def buildDeadbands(self):
+        self.deadbands = {}
+        for key in self.customMon:
+            mon = self.customMon[key]
+            if mon.get('deadband') is None or str(mon.get('deadband')).strip() == "":
+                continue
+            try:
+                self.deadbands[key] = [abs(float(mon['deadband'])),max(float(mon.get('heartbeat') or 0),0)]
+            except ValueError:
+                self._logger.warning("Invalid deadband for %s: %s",key,mon['deadband'])
+
+    # Adaptive monitors runs between minInterval and maxInterval depending on how fast the value changes
+    # Controllers are kept if the settings did not change so a save does not reset them
+    def buildAdaptive(self):
+        oldAdaptive = self.adaptive
+        self.adaptive = {}
+        for key in self.customMon:
+            mon = self.customMon[key]
+            if not mon.get('adaptive') or mon.get('type') not in ("cmd","sysfs","multi","psutil"):
+                # Back to the fixed interval
+                if key in oldAdaptive:
+                    self.scheduler.setInterval(key,int(mon['interval']))
+                continue
+            try:
+                tolerance = self.deadbands[key][0] if key in self.deadbands else None
+                adaptive = AdaptiveInterval(mon['minInterval'],mon['maxInterval'],mon['interval'],tolerance)
+            except (KeyError, TypeError, ValueError):
+                self._logger.warning("Invalid adaptive intervals for %s",key)
+                continue
+            old = oldAdaptive.get(key)
+            if old is not None and [old.minInterval,old.maxInterval,old.tolerance] == [adaptive.minInterval,adaptive.maxInterval,adaptive.tolerance]:
+                adaptive = old
+            self.adaptive[key] = adaptive
+            self.scheduler.setInterval(key,adaptive.interval)
+
+    # Shortest interval a monitor can run with - used to size history and caches
+    def shortestInterval(self,mon):
+        if mon.get('adaptive') and mon.get('type') in ("cmd","sysfs","multi","psutil"):
+            try:
+                return max(min(int(mon['minInterval']),int(mon['interval'])),1)
+            except (KeyError, TypeError, ValueError):
+                pass
+        return int(mon['interval'])
+
+    # Slow all monitors down while the 1 minute load average is above loadBackoff - the further above the slower
+    def checkHostLoad(self):
+        threshold = self._settings.get_float(["loadBackoff"]) or 0
+        slowdown = 1.0
+        if threshold > 0:
+            load = self.runPSUtil("loadCheck","loadavg1",True)
+            if load is not None and load > threshold:
+                slowdown = min(load/threshold*2,4.0)
+        if slowdown != self.scheduler.slowdown:
+            self.debugOut("Host load changed - running monitors " + str(slowdown) + " times slower")
+            self.scheduler.setSlowdown(slowdown)
+
+    def passesDeadband(self,indx,timestamp,value):
+        deadband = self.deadbands.get(monitorKey(indx))
+        if deadband is None or indx not in self.customHistory:
+            return True
+        last = self.customHistory[indx].last()
+        if last is None or abs(value - last[1]) > deadband[0]:
+            return True
+        return deadband[1] > 0 and timestamp - last[0] >= deadband[1]
+
+    # A line from a stream monitor
+    def handleStreamLine(self,indx,line):
+        self.handleCustomData(indx,line,time.time())
+
+    # Trigger by the timer - read a sysfs file directly
+    def runSysfs(self,indx,filePath):
+        try:
+            if os.path.basename(filePath) == "w1_slave":
+                value = self.w1Bus.read(filePath)
+            else:
+                value = sensors.readSysfsValue(filePath)
+        except (IOError, OSError, ValueError) as err:
+            self.debugOut(filePath + " failed with error: " + str(err))
+            self._plugin_manager.send_plugin_message(self._identifier, dict(success=False,error=str(err),returnCode=1,result=None,key=indx,type="custom"))
+            return
+        self.debugOut(filePath + "("+indx+") returned: " +str(value) + " for index :"+indx)
+        self.handleCustomData(indx,value,time.time())
 
+    # Trigger by the timer - the reader is precompiled by buildPsuUtil
+    def runPSUtil(self,indx,cmd,returnData = False):
         returnVal = None
+        reader = self.psutilReaders.get(cmd)
+        if reader is not None:
+            try:
+                returnVal = reader.read()
+            except (KeyError, IndexError, AttributeError, OSError) as err:
+                # Sensor/disk gone since we build the readers
+                self.debugOut("psutil " + cmd + " failed: " + str(err))
+
+        if returnVal is None:
+            return None
+
+        self.debugOut("psutil " + cmd + " returned: " + str(returnVal) + " for index :"+indx)
+        if returnData:
+            return returnVal
+        self.handleCustomData(indx,returnVal,time.time())
+
+    # Build the history response
+    # Without options the full history is returned as {key: [[time, value], ...]}
+    # Options:
+    #   keys     : list of keys to return
+    #   since    : timestamp or {key: timestamp} - only return newer data
+    #   gen      : {key: generation} as returned earlier - since is ignored if the history has been reset
+    #   encoding : list, delta or f32 - see history.encodeHistory
+    #   raw      : return the values before post calculation
+    #   window   : seconds of history wanted - windows longer than the raw history are served from the rollups
+    #   points   : max number of points per key - the raw history is downsampled, cached until new data arrives
+    #   method   : lttb or minmax - see downsample.py
+    # With options each key returns {'gen','full','first','enc','tier','data'}
+    # tier is 0 for raw data or the bucket size in seconds - rollups also returns 'min' and 'max' and data is the mean.
+    # Rollups also returns 'partial' - if set the last point is the bucket still being filled, it is sent again until
+    # it is closed so use the time before it as since
+    def getCustomHistory(self,data):
+        if not any(option in data for option in ('keys','since','encoding','window','points')):
+            return {key: self.customHistory[key].toList() for key in list(self.customHistory)}
+
+        keys = data.get('keys') or list(self.customHistory)
+        since = data.get('since')
+        gens = data.get('gen') or {}
+        encoding = data.get('encoding') or 'list'
+        if encoding not in historyEncodings:
+            encoding = 'list'
+        try:
+            points = int(data.get('points') or 0)
+            window = float(data['window']) if data.get('window') else None
+            if isinstance(since,dict):
+                since = {key: float(since[key]) if since[key] is not None else None for key in since}
+            elif since is not None:
+                since = float(since)
+        except (TypeError, ValueError):
+            flask.abort(400, description="Invalid history options")
+        if points < 0 or (window is not None and window <= 0) or not isinstance(keys,list) or not isinstance(gens,dict):
+            flask.abort(400, description="Invalid history options")
+        method = data.get('method') if data.get('method') in downsampleMethods else 'lttb'
+
+        result = {}
+        for key in keys:
+            history = self.customHistory.get(key)
+            if history is None:
+                continue
+            keySince = since.get(key) if isinstance(since,dict) else since
+            # Reset since the client last fetched - send it all
+            if keySince is not None and key in gens and gens[key] != history.generation:
+                keySince = None
+            # Clients has the times rounded to the ms by encodeHistory
+            if keySince is not None:
+                keySince += 0.0005
+            rollup = None
+            if window is not None and key in self.customRollups:
+                rollup = selectRollup(self.customRollups[key],window,history.capacity*float(self.shortestInterval(self.customMon[monitorKey(key)])))
+            if rollup is not None:
+                result[key] = self.getRollupHistory(rollup,window,keySince,gens.get(key),encoding)
+                continue
+
+            full = keySince is None
+            # The raw history covers the window - only send the window
+            if window is not None:
+                windowStart = time.time() - window
+                keySince = windowStart if keySince is None else max(keySince,windowStart)
+            if points and keySince is None:
+                times, values = self.downsampled.get(key,history,points,method,bool(data.get('raw')))
+            else:
+                times, values = history.since(keySince,bool(data.get('raw')))
+                if points and full:
+                    times, values = downsample(times,values,points,method)
+            first = history.first()
+            result[key] = {
+                'gen' : history.generation,
+                'full' : full,
+                'first' : first[0] if first is not None else None,
+                'enc' : encoding,
+                'tier' : 0,
+                'data' : encodeHistory(times,values,encoding)
+            }
+        return result
+
+    # Build the history response for one rollup - see getCustomHistory
+    def getRollupHistory(self,rollup,window,since,gen,encoding):
+        if gen is not None and gen != rollup.generation:
+            since = None
+        full = since is None
+        if since is None:
+            since = time.time() - float(window)
+        times, mins, maxs, means, partial = rollup.since(since,True)
+        return {
+            'gen' : rollup.generation,
+            'full' : full,
+            'first' : rollup.first(),
+            'enc' : encoding,
+            'tier' : rollup.bucketSecs,
+            'partial' : partial,
+            'data' : encodeHistory(times,means,encoding),
+            'min' : encodeValues(mins,encoding),
+            'max' : encodeValues(maxs,encoding)
+        }
 
-        # Lazy switch
-
-        # Cpu percentage
-        if cmd == "cpup":
-            if self.psutilCPUHasRun == False:
-                psutil.cpu_percent(interval=None)
-                self.psutilCPUHasRun = True
-            returnVal = psutil.cpu_percent(interval=None)
-
-        # Cpu freque
-        if cmd == "cpuf":
-            returnVal = psutil.cpu_freq(percpu=False).current
-
-        # Load avg
-        if cmd == "loadavg1":
-            returnVal = psutil.getloadavg()[0]
-        if cmd == "loadavg5":
-            returnVal = psutil.getloadavg()[1]
-        if cmd == "loadavg15":
-            returnVal = psutil.getloadavg()[2]
-
-        # Mem
-        if cmd == "memtotal":
-            returnVal = psutil.virtual_memory().total/1048576
-        if cmd == "memavail":
-            returnVal = psutil.virtual_memory().available/1048576
-        if cmd == "memused":
-            returnVal = psutil.virtual_memory().used/1048576
-        if cmd == "memfree":
-            returnVal = psutil.virtual_memory().free/1048576
-        if cmd == "memp":
-            returnVal = psutil.virtual_memory().percent
-
-        # swap
-        if cmd == "swaptotal":
-            returnVal = psutil.swap_memory().total/1048576
-        if cmd == "swapused":
-            returnVal = psutil.swap_memory().used/1048576
-        if cmd == "swapfree":
-            returnVal = psutil.swap_memory().free/1048576
-        if cmd == "swapperc":
-            returnVal = psutil.swap_memory().percent
-
-        # battery info
-        if cmd == "batsec":
-            if hasattr(psutil, "sensors_battery"):
-                returnVal = psutil.sensors_battery().secsleft
-        if cmd == "batper":
-            if hasattr(psutil, "sensors_battery"):
-                returnVal = psutil.sensors_battery().percent
-
-        # Return if we found something now
-        if returnVal:
-            self.debugOut("psutil " + cmd + " returned: " + str(returnVal) + " for index :"+indx)
-            if returnData:
-                return returnVal
-            self.handleCustomData(indx,returnVal,time.time())
-
-        # Disk
-        if cmd[0:4] == "disk":
-            if cmd in self.psutilList:
-                diskCmd = cmd.split("_")[0]
-                partion = self.psutilList[cmd][1]
-                diskUsage = psutil.disk_usage(partion)
-                if diskUsage:
-                    if diskCmd == "diskfree":
-                        returnVal = diskUsage.free/1048576
-                    if diskCmd == "disktotal":
-                        returnVal = diskUsage.total/1048576
-                    if diskCmd == "diskused":
-                        returnVal = diskUsage.used/1048576
-                    if diskCmd == "diskperc":
-                        returnVal = diskUsage.percent
-
-        # Temp
-        if cmd[0:4] == "temp":
-            if hasattr(psutil, "sensors_temperatures"):
-                if cmd in self.psutilList:
-                    tempName = self.psutilList[cmd][1][0]
-                    tempEntry = self.psutilList[cmd][1][1]
-                    temps = psutil.sensors_temperatures()
-                    if temps and tempName in temps:
-                        returnVal = temps[tempName][tempEntry].current
-
-        # Fans
-        if cmd[0:8] == "fanspeed":
-            if hasattr(psutil, "sensors_fans"):
-                if cmd in self.psutilList:
-                    fanName = self.psutilList[cmd][1][0]
-                    fanEntry = self.psutilList[cmd][1][1]
-                    fans = psutil.sensors_fans()
-                    if fans and fanName in fans:
-                        returnVal = fans[fanName][fanEntry].current
-
-        if returnVal:
-            self.debugOut("psutil " + cmd + " returned: " + str(returnVal) + " for index :"+indx)
-            if returnData:
-                return returnVal
-            self.handleCustomData(indx,returnVal,time.time())
+    # we keep the history for double the needed just for fun - series of multi value monitors uses the monitor settings
+    def historyCapacity(self,indx):
+        mon = self.customMon[monitorKey(indx)]
+        return math.ceil(int(mon['gHisSecs'])/self.shortestInterval(mon))*2
 
-        if returnData:
-                return None
+    # Seconds the rolling stats covers - same as the graph
+    def statsWindow(self,indx):
+        return int(self.customMon[monitorKey(indx)]['gHisSecs'])
 
     def handleCustomData(self,indx,out,time):
+        # Lines queued before the monitor was deleted
+        if monitorKey(indx) not in self.customMon:
+            return
         # Check
         if isinstance(out,(float, int)) or self.checkStringIsVal(out):
             self.debugOut("Got good custom data for "+indx+": " + str(out))
-            resultData = [time,float(out)]
+            raw = float(out)
+            calc = self.postCalcs.get(monitorKey(indx))
+            resultData = [time,calc(raw) if calc is not None else raw]
+
+            # Rollups and stats gets every value
+            if indx not in self.customRollups:
+                self.customRollups[indx] = createRollups()
+            for rollup in self.customRollups[indx]:
+                rollup.add(time,resultData[1])
+            if indx not in self.customStats:
+                self.customStats[indx] = RollingStats(self.statsWindow(indx))
+            self.customStats[indx].add(time,resultData[1])
+            if indx in self.adaptive:
+                interval = self.adaptive[indx].update(resultData[1])
+                if interval is not None:
+                    self.debugOut("Adaptive interval for " + indx + " is now " + str(interval) + " seconds")
+                    self.scheduler.setInterval(indx,interval)
+
+            # History and the UI only gets values outside the deadband - the graphs holds the last value
+            if not self.passesDeadband(indx,time,resultData[1]):
+                self.debugOut("Custom data for " + indx + " within deadband: " + str(out))
+                return
+
             if indx not in self.customHistory:
-                self.customHistory[indx] = []
-            self.customHistory[indx].append(resultData)
-            # we keep the history for double the needed just for fun
-            sliceMe = math.ceil(0 - ((int(self.customMon[indx]['gHisSecs'])/int(self.customMon[indx]['interval']))))*2
-            self.debugOut(indx + " only wants " + str(self.customMon[indx]['gHisSecs']) + " seconds of data - we need to slice: " + str(sliceMe))
-            self.customHistory[indx] = self.customHistory[indx][sliceMe:]
+                self.debugOut(indx + " only wants " + str(self.customMon[monitorKey(indx)]['gHisSecs']) + " seconds of data - keeping: " + str(self.historyCapacity(indx)))
+                self.customHistory[indx] = HistoryBuffer(self.historyCapacity(indx))
+            self.customHistory[indx].append(time,resultData[1],raw)
+            store = self.historyStores.get(indx)
+            if store is None and self.persistHistory:
+                store = self.openHistoryStore(indx)
+            if store is not None:
+                store.append(time,resultData[1],raw)
 
             # send to the frontend
             self.debugOut("Sending data to UI, " + indx + " : " + str(out))
-            self._plugin_manager.send_plugin_message(self._identifier, dict(success=True,error=None,returnCode=0,result=resultData,key=indx,type="custom"))
+            self.batcher.add(indx,resultData)
         else:
             self.debugOut("Got BAD custom data for "+indx+": " + str(out))
 
+    # ----------------------------------------------------------------------------------------------------------------
+    # History files - one memory mapped ring file per monitor in the plugin data folder
+    def historyStorePath(self,indx):
+        return os.path.join(self.get_plugin_data_folder(),"history",indx + ".ring")
+
+    def openHistoryStore(self,indx):
+        with self.historyStoresLock:
+            if indx in self.historyStores:
+                return self.historyStores[indx]
+            if indx in self.historyStoresFailed:
+                return None
+            folder = os.path.dirname(self.historyStorePath(indx))
+            try:
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                self.historyStores[indx] = HistoryStore(self.historyStorePath(indx),self.historyCapacity(indx))
+            except (IOError, OSError, ValueError) as err:
+                self._logger.warning("Unable to open history file for %s: %s",indx,err)
+                self.historyStoresFailed.add(indx)
+                return None
+            return self.historyStores[indx]
+
+    # Load the stored history into the history buffers and rollups
+    def loadHistoryStores(self):
+        self.persistHistory = self._settings.get_boolean(["persistHistory"])
+        self.historyStoresFailed = set()
+        if not self.persistHistory:
+            return
+        keys = []
+        for indx in self.customMon:
+            if not self.customMon[indx]['cmd']:
+                continue
+            keys.append(indx)
+            # Series of multi value monitors
+            if self.customMon[indx]['type'] == "multi":
+                for filePath in glob.glob(self.historyStorePath(indx + ".*")):
+                    keys.append(os.path.basename(filePath)[:-len(".ring")])
+
+        for indx in keys:
+            store = self.openHistoryStore(indx)
+            if store is None:
+                continue
+            records = store.load()
+            if not records:
+                continue
+            self.debugOut("Loaded " + str(len(records)) + " stored data points for " + indx)
+            history = HistoryBuffer(self.historyCapacity(indx))
+            rollups = createRollups()
+            stats = RollingStats(self.statsWindow(indx))
+            for timestamp, value, raw in records:
+                history.append(timestamp,value,raw)
+                for rollup in rollups:
+                    rollup.add(timestamp,value)
+                stats.add(timestamp,value)
+            self.customHistory[indx] = history
+            self.customRollups[indx] = rollups
+            self.customStats[indx] = stats
+
+    # Write the full history buffer to the store - after resize/recalculation
+    def writeHistoryStore(self,indx):
+        store = self.historyStores.get(indx)
+        if store is None or indx not in self.customHistory:
+            return
+        times, values, raws = self.customHistory[indx].export()
+        store.rewrite(self.customHistory[indx].capacity,times,values,raws)
+
+    # Remove history, rollups, stats and stored history for a monitor and its series
+    def clearMonitorHistory(self,indx):
+        for key in set(self.customHistory) | set(self.customRollups) | set(self.customStats) | set(self.historyStores):
+            if monitorKey(key) == indx:
+                self.customHistory.pop(key,None)
+                self.customRollups.pop(key,None)
+                self.customStats.pop(key,None)
+                self.downsampled.remove(key)
+                self.removeHistoryStore(key)
+        self.removeHistoryStore(indx)
+
+    def removeHistoryStore(self,indx):
+        with self.historyStoresLock:
+            store = self.historyStores.pop(indx,None)
+            if store is not None:
+                store.remove()
+            elif path.isfile(self.historyStorePath(indx)):
+                os.remove(self.historyStorePath(indx))
+
+    def closeHistoryStores(self):
+        with self.historyStoresLock:
+            stores = self.historyStores
+            self.historyStores = {}
+        for indx in stores:
+            stores[indx].close()
+
+    # Follow the persistHistory setting - open stores for all monitors or remove the files
+    def configureHistoryStores(self):
+        self.persistHistory = self._settings.get_boolean(["persistHistory"])
+        self.historyStoresFailed = set()
+        if self.persistHistory:
+            for indx in list(self.customHistory):
+                if indx not in self.historyStores and self.openHistoryStore(indx) is not None:
+                    self.writeHistoryStore(indx)
+        else:
+            for indx in list(self.historyStores):
+                self.removeHistoryStore(indx)
+
+    # Resolve the settings for all items shown once instead of merging the settings on every getItems call
+    def buildItemModel(self):
+        sortOrder = self._settings.get(["sortOrder"],merged=True,asdict=True)
+        custom = self._settings.get(["customMon"],merged=True,asdict=True)
+        items = {}
+        for item in sortOrder:
+            if item in custom:
+                items[item] = custom[item]
+            else:
+                items[item] = self._settings.get([item],merged=True,asdict=True)
+        itemsJson = json.dumps(items,sort_keys=True)
+        self.itemModel = {
+            'sortOrder' : list(sortOrder),
+            'custom' : set(custom),
+            'itemsJson' : itemsJson,
+            'etag' : hashlib.sha1(itemsJson.encode("utf-8")).hexdigest()[:16]
+        }
+        return self.itemModel
+
+    # Update the message batcher from the settings - window is in ms
+    # A blank pushWindow is the default - 0 is valid and sends right away
+    def configureBatcher(self):
+        pushWindow = self._settings.get_int(["pushWindow"])
+        if pushWindow is None:
+            pushWindow = 250
+        self.batcher.configure(pushWindow/1000.0,self._settings.get_boolean(["pushAllPoints"]))
+
+    # Update the max number of commands running at the same time from the settings
+    def configureExecutor(self):
+        self.cmdExecutor.configure(self._settings.get_int(["cmdConcurrency"]) or 1)
+
+    # Update the gcode queue size and overflow policy from the settings
+    def configureGcodeQueue(self):
+        self.gcodeQue.configure(self._settings.get_int(["gcodeQueueSize"]) or 1000,self._settings.get(["gcodeOverflow"]))
+
+    # Send collected data for all monitors as one message: data = {key: [[time, value], ...]}
+    def sendCustomBatch(self,data):
+        self._plugin_manager.send_plugin_message(self._identifier, dict(success=True,error=None,returnCode=0,result=None,data=data,type="customBatch"))
+
     # Available commands and parameters
     # testCmd: will run any command
     # monitorservice - can be stop/(re)start og status
     # getCustomHistory
     # getPredefined will retrieve all the predefined monitoring options available
+    # getStats will return queue/backlog counters
+    # getMonitorStats will return min/max/avg/stddev/rate for all custom monitors
     def get_api_commands(self):
         return dict(
             testCmd=['cmd'],
@@ -762,7 +1415,9 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             getCustomHistory=[],
             getDefaultSettings=[],
             getPredefined=['reload'],
-            getItems=[]
+            getItems=[],
+            getStats=[],
+            getMonitorStats=[]
         )
 
     # handle api calls
@@ -772,38 +1427,78 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
         # Get cpu temp options found on this system - allows a reload
         if command == "getPredefined":
+            # The new options are sent as a "predefined" message when found
             if data["reload"] == True:
                 self.debugOut("Reloading temperature options")
-                self.checkCpuTempMethods()
-                self.buildPsuUtil()
+                self.startDiscovery()
 
             self.debugOut("Sending options")
-            return flask.jsonify({'cmds' : self.tempCmds,'psutil' : self.psutilList})
+            return flask.jsonify({'cmds' : self.tempCmds,'psutil' : self.psutilList,'refreshing' : self.discoveryRunning})
 
+        # The settings part is pre-serialized by buildItemModel - unchanged responses returns 304 using the ETag
         if command == "getItems":
-            self._logger.info("Sending items monitored")
-            sortOrder = self._settings.get(["sortOrder"],merged=True,asdict=True)
-            custom = self._settings.get(["customMon"],merged=True,asdict=True)
+            self.debugOut("Sending items monitored")
+            model = self.itemModel
+            if model is None:
+                model = self.buildItemModel()
             curTemps = self._printer.get_current_temperatures()
-            returnList = {}
             lastValues = {}
-            for item in sortOrder:
+            paused = {}
+            # Downsampled history for the graphs if points is given
+            try:
+                points = int(data.get('points') or 0)
+            except (TypeError, ValueError):
+                flask.abort(400, description="Invalid points")
+            if points < 0:
+                flask.abort(400, description="Invalid points")
+            method = data.get('method') if data.get('method') in downsampleMethods else 'lttb'
+            history = {}
+            for item in model['sortOrder']:
                 lastVal = None
-                if item in custom:
-                    returnList[item] = custom[item]
+                if item in model['custom']:
+                    paused[item] = item in self.pausedMons
                     if item in self.customHistory:
-                        lastVal = self.customHistory[item] and self.customHistory[item][-1][1] or None
-                else:
-                    if item in curTemps:
-                        lastVal = curTemps[item]['actual']
-                    returnList[item] = self._settings.get([item],merged=True,asdict=True)
+                        lastItem = self.customHistory[item].last()
+                        if lastItem is not None:
+                            lastVal = lastItem[1]
+                        if points:
+                            times, values = self.downsampled.get(item,self.customHistory[item],points,method)
+                            history[item] = encodeHistory(times,values)
+                elif item in curTemps:
+                    lastVal = curTemps[item]['actual']
                 lastValues[item] = lastVal
-            return flask.jsonify({'items' : returnList,'lastValues': lastValues})
+            state = {'lastValues': lastValues,'paused': paused}
+            if points:
+                state['history'] = history
+            stateJson = json.dumps(state,sort_keys=True)
+            response = flask.Response('{"items":' + model['itemsJson'] + ',' + stateJson[1:],mimetype="application/json")
+            response.set_etag(model['etag'] + "-" + hashlib.sha1(stateJson.encode("utf-8")).hexdigest()[:16])
+            return response.make_conditional(flask.request)
+
+        # Internal counters to see if the host is keeping up
+        if command == "getStats":
+            return flask.jsonify({
+                'gcodeQueue' : self.gcodeQue.stats(),
+                'commands' : self.cmdExecutor.stats(),
+                'commandCache' : self.cmdCache.stats(),
+                'streams' : self.streams.stats(),
+                'downsample' : {'hits': self.downsampled.hits, 'misses': self.downsampled.misses},
+                'scheduler' : self.scheduler.stats()
+            })
+
+        # Rolling stats over the gHisSecs window for every custom monitor and series
+        if command == "getMonitorStats":
+            result = {}
+            for key in list(self.customStats):
+                stats = self.customStats[key].snapshot()
+                if stats is not None:
+                    result[key] = stats
+            return flask.jsonify(result)
 
         # Get history data
         if command == "getCustomHistory":
             self.debugOut("Sending custom history")
-            return flask.jsonify(self.customHistory)
+            return flask.jsonify(self.getCustomHistory(data))
 
         # Get template setting
         if command == "getDefaultSettings":
@@ -822,12 +1517,28 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             cmdType = data["type"]
             if cmdType == "psutil":
                 result = self.runPSUtil("TEST",cmdInput,True)
-                if result:
+                if result is not None:
                     repsonse = dict(success=True,error=None,returnCode=200,result=result)
                 else:
                     repsonse = dict(success=False,error="No data returned",returnCode=404,result=None)
                 return flask.jsonify(repsonse)
 
+            if cmdType == "sysfs":
+                try:
+                    result = sensors.readSysfsValue(cmdInput)
+                    repsonse = dict(success=True,error=None,returnCode=0,result=result)
+                except (IOError, OSError, ValueError) as err:
+                    repsonse = dict(success=False,error=str(err),returnCode=1,result=None)
+                return flask.jsonify(repsonse)
+
+            # Multi value commands are tested with the parser settings from the UI
+            parser = None
+            if cmdType == "multi":
+                try:
+                    parser = MultiValueParser(data.get('parser'),data.get('series'))
+                except ValueError as err:
+                    return flask.jsonify(dict(success=False,error=str(err),returnCode=1,result=None))
+
             cmd = cmdInput.split(" ", 1)
             cmdFound = True
 
@@ -843,10 +1554,16 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
             # did we find it?
             if cmdFound:
-                code, out, err = self.runcommand(cmdInput)
+                code, out, err = self.cmdCache.run(cmdInput)
                 out = out.rstrip("\n")
                 if code or err:
                     repsonse = dict(success=False,error=err,returnCode=code,result=out)
+                elif parser is not None:
+                    values = parser.parse(out)
+                    if values:
+                        repsonse = dict(success=True,error=err,returnCode=code,result=", ".join(name + ": " + str(values[name]) for name in values))
+                    else:
+                        repsonse = dict(success=False,error="No values found",returnCode=code,result=out)
                 else:
                     if isinstance(out,(float, int)) or self.checkStringIsVal(out):
                         repsonse = dict(success=True,error=err,returnCode=code,result=out)
@@ -884,7 +1601,9 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
         return dict2
 
     # run command wrapper
-    def runcommand (self,cmd):
+    def runcommand (self,cmd,timeout=None):
+        if timeout is None:
+            timeout = self.cmdTimeout
         thisExec = None
         if sys.platform.startswith("linux"):
             thisExec = '/bin/bash'
@@ -893,13 +1612,16 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
                                 stderr=subprocess.PIPE,
                                 shell=True,
                                 executable=thisExec,
-                                universal_newlines=True)
+                                universal_newlines=True,
+                                start_new_session=True)
         try:
-            std_out, std_err = proc.communicate(timeout=self.cmdTimeout)
+            std_out, std_err = proc.communicate(timeout=timeout)
         except subprocess.TimeoutExpired:
-            proc.kill()
+            # Kill everything the shell started and reap it - a child left running keeps the pipes open
+            signalProcessGroup(proc,True)
+            proc.communicate()
             self._logger.warning("\""+cmd+"\" timed out")
-            return -1, "\""+cmd+"\" timed out", "Maximum execution time, "+self.cmdTimeout+" seconds, exceeded!"
+            return -1, "\""+cmd+"\" timed out", "Maximum execution time, "+str(timeout)+" seconds, exceeded!"
 
         return proc.returncode, std_out.strip(), std_err
 
@@ -937,19 +1659,15 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
     def gcodeRecvQworker(self):
         while True:
-            item = self.gcodeQue.get()
-            gcodeCmdLib = self.gcodeCmds[item['type']]
-            for cKey in gcodeCmdLib:
-                pattern = gcodeCmdLib[cKey]
-                dataStr = item['data'].strip()
-                # self.debugOut("gcode "+item['type']+" macthing : " + cKey + " for string \""+dataStr+"\"" )
-                match = re.search(pattern, dataStr)
-                if match:
-                    # self.debugOut("----------------------------------------->>> gcode "+item['type']+" matched: " + dataStr)
-                    self.handleCustomData(cKey,match.group(1),item['time'])
-
-            # All done - next task please :)
-            self.gcodeQue.task_done()
+            for item in self.gcodeQue.getBatch(self.gcodeBatchSize):
+                # A failing line must not stop the only gcode worker - ie. a monitor deleted while its lines are queued
+                try:
+                    # One pass for all the monitors of this direction
+                    for cKey, value in self.gcodeMatchers[item['type']].match(item['data'].strip()):
+                        # self.debugOut("----------------------------------------->>> gcode "+item['type']+" matched: " + cKey)
+                        self.handleCustomData(cKey,value,item['time'])
+                except Exception:
+                    self._logger.exception("GCode monitor failed for: %s",item.get('data'))
 
 
     def gCodeHandlerRecv(self, comm, line, *args, **kwargs):
@@ -957,6 +1675,11 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
             # self.debugOut("No gcode IN check needed")
             return line
 
+        # Skip lines no monitor can match
+        prefixes = self.gcodePrefixIn
+        if prefixes is not None and not line.lstrip().startswith(prefixes):
+            return line
+
         # self.debugOut("gcode IN check needed")
         dataSet = {'time':time.time(),'type' : 'gcIn', 'data':line}
         self.gcodeQue.put(dataSet)
@@ -972,10 +1695,14 @@ class TopTempPlugin(octoprint.plugin.StartupPlugin,
 
         # Turn off fan special handling
         if gcode and gcode == "M107":
-            dataSet = {'time':time.time(), 'type' : 'gcOut', 'data': "M106 S0"}
-        else:
-            dataSet = {'time':time.time(),'type' : 'gcOut', 'data': cmd}
+            cmd = "M106 S0"
+
+        # Skip lines no monitor can match
+        prefixes = self.gcodePrefixOut
+        if prefixes is not None and not cmd.lstrip().startswith(prefixes):
+            return
 
+        dataSet = {'time':time.time(),'type' : 'gcOut', 'data': cmd}
         self.gcodeQue.put(dataSet)
 
     def checkStringIsVal(self,inputStr):
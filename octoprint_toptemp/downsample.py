@@ -0,0 +1,109 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+from array import array
+
+# ----------------------------------------------------------------------------------------------------------------
+# Downsampling of history for the graphs - they are only a few hundred pixels wide so there is no need to send
+# every point.
+#   lttb   : Largest-Triangle-Three-Buckets - keeps the visual shape of the line
+#   minmax : min and max of each bucket - keeps the peaks
+# ----------------------------------------------------------------------------------------------------------------
+downsampleMethods = ['lttb', 'minmax']
+
+def lttb(times, values, threshold):
+    count = len(times)
+    if threshold >= count or threshold < 3:
+        return times, values
+
+    outTimes = array('d', [times[0]])
+    outValues = array('d', [values[0]])
+    every = float(count - 2) / (threshold - 2)
+    selected = 0
+
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+
+        # Average of the next bucket
+        nextStart = end
+        nextEnd = min(int((bucket + 2) * every) + 1, count)
+        nextLen = nextEnd - nextStart
+        avgTime = sum(times[nextStart:nextEnd]) / nextLen
+        avgValue = sum(values[nextStart:nextEnd]) / nextLen
+
+        # Point in this bucket with the largest triangle against the last selected point and the next average
+        pointTime = times[selected]
+        pointValue = values[selected]
+        spanTime = avgTime - pointTime
+        spanValue = avgValue - pointValue
+        areas = [abs(spanTime * (values[indx] - pointValue) - spanValue * (times[indx] - pointTime)) for indx in range(start, end)]
+        selected = start + areas.index(max(areas))
+
+        outTimes.append(times[selected])
+        outValues.append(values[selected])
+
+    outTimes.append(times[count - 1])
+    outValues.append(values[count - 1])
+    return outTimes, outValues
+
+def minMax(times, values, threshold):
+    count = len(times)
+    buckets = threshold // 2
+    if threshold >= count or buckets < 1:
+        return times, values
+
+    outTimes = array('d')
+    outValues = array('d')
+    every = float(count) / buckets
+    for bucket in range(buckets):
+        start = int(bucket * every)
+        end = int((bucket + 1) * every)
+        chunk = values[start:end]
+        low = start + chunk.index(min(chunk))
+        high = start + chunk.index(max(chunk))
+        # keep the time order
+        for indx in sorted(set((low, high))):
+            outTimes.append(times[indx])
+            outValues.append(values[indx])
+    return outTimes, outValues
+
+def downsample(times, values, points, method="lttb"):
+    if method == "minmax":
+        return minMax(times, values, points)
+    return lttb(times, values, points)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Downsampled series per monitor - valid until the history changes
+# ----------------------------------------------------------------------------------------------------------------
+class DownsampleCache(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [(generation, version, points, method, raw), times, values]
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, history, points, method="lttb", raw=False):
+        state = (history.generation, history.version, points, method, raw)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == state:
+                self.hits += 1
+                return cached[1], cached[2]
+        times, values = history.since(None, raw)
+        times, values = downsample(times, values, points, method)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = [state, times, values]
+        return times, values
+
+    def remove(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache = {}
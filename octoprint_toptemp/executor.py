@@ -0,0 +1,179 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Signal a command started with start_new_session=True and everything it started - killing only the shell leaves
+# the rest of a pipeline running
+def signalProcessGroup(proc, force=False):
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+        except OSError:
+            pass
+    else:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Runs the commands for the cmd monitors on a small pool of its own so a slow or hung command can never block the
+# scheduler workers and only maxConcurrent commands runs at the same time.
+# A monitor only has one run at a time - if the previous run is still waiting or running the new one is skipped.
+# ----------------------------------------------------------------------------------------------------------------
+class CommandExecutor(object):
+    def __init__(self, maxConcurrent=2, logger=None):
+        self._logger = logger or logging.getLogger("octoprint.plugins.toptemp")
+        self._lock = threading.Lock()
+        self._pool = None
+        self.maxConcurrent = maxConcurrent
+        # key -> submit time for runs waiting or running
+        self._inFlight = {}
+        # key -> counters
+        self._stats = {}
+
+    def configure(self, maxConcurrent):
+        maxConcurrent = max(int(maxConcurrent), 1)
+        with self._lock:
+            if maxConcurrent == self.maxConcurrent and self._pool is not None:
+                return
+            self.maxConcurrent = maxConcurrent
+            oldPool = self._pool
+            self._pool = ThreadPoolExecutor(max_workers=maxConcurrent)
+        # Runs already submitted to the old pool finishes there
+        if oldPool is not None:
+            oldPool.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _keyStats(self, key):
+        if key not in self._stats:
+            self._stats[key] = {'runs': 0, 'skipped': 0, 'waiting': 0, 'running': 0, 'maxWait': 0.0, 'lastDuration': None}
+        return self._stats[key]
+
+    # Run func(*args) for key and hand the result to callback - returns False if skipped
+    def submit(self, key, func, args, callback):
+        with self._lock:
+            stats = self._keyStats(key)
+            if key in self._inFlight or self._pool is None:
+                stats['skipped'] += 1
+                return False
+            self._inFlight[key] = time.time()
+            stats['waiting'] += 1
+            try:
+                self._pool.submit(self._run, key, func, args, callback)
+            except RuntimeError:
+                # Pool is shutting down
+                del self._inFlight[key]
+                stats['waiting'] -= 1
+                return False
+        return True
+
+    def _run(self, key, func, args, callback):
+        started = time.time()
+        with self._lock:
+            stats = self._keyStats(key)
+            stats['waiting'] -= 1
+            stats['running'] += 1
+            stats['maxWait'] = max(stats['maxWait'], started - self._inFlight.get(key, started))
+        try:
+            callback(func(*args))
+        except Exception:
+            self._logger.exception("Command for \"%s\" failed", key)
+        finally:
+            with self._lock:
+                stats['running'] -= 1
+                stats['runs'] += 1
+                stats['lastDuration'] = time.time() - started
+                self._inFlight.pop(key, None)
+
+    def remove(self, key):
+        with self._lock:
+            self._stats.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'maxConcurrent' : self.maxConcurrent,
+                'inFlight' : len(self._inFlight),
+                'monitors' : {key: dict(self._stats[key]) for key in self._stats}
+            }
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Results per command string - monitors using the same command shares one run:
+# - a result newer than the ttl is reused
+# - callers arriving while the command is running waits for that run instead of starting their own
+# ----------------------------------------------------------------------------------------------------------------
+class CommandCache(object):
+    def __init__(self, runFunc):
+        self._run = runFunc
+        self._lock = threading.Lock()
+        # cmd -> [timestamp, result]
+        self._results = {}
+        # cmd -> [event, result]
+        self._flights = {}
+        # cmd -> ttl in seconds
+        self.ttls = {}
+        self.runs = 0
+        self.hits = 0
+        self.shared = 0
+
+    # Replace the ttl per command - results for commands no longer in use are dropped
+    def setTtls(self, ttls):
+        with self._lock:
+            self.ttls = dict(ttls)
+            for cmd in list(self._results):
+                if cmd not in self.ttls:
+                    del self._results[cmd]
+
+    def run(self, cmd, timeout=None):
+        with self._lock:
+            cached = self._results.get(cmd)
+            if cached is not None and time.time() - cached[0] < self.ttls.get(cmd, 0):
+                self.hits += 1
+                return cached[1]
+            flight = self._flights.get(cmd)
+            owner = flight is None
+            if owner:
+                flight = [threading.Event(), None]
+                self._flights[cmd] = flight
+            else:
+                self.shared += 1
+
+        # Someone else is running it - wait no longer than our own timeout
+        if not owner:
+            if not flight[0].wait(timeout):
+                return -1, "\"" + cmd + "\" timed out", "Maximum execution time, " + str(timeout) + " seconds, exceeded!"
+            return flight[1]
+
+        try:
+            result = self._run(cmd, timeout)
+        except Exception as err:
+            result = (-1, "", str(err))
+        with self._lock:
+            self.runs += 1
+            flight[1] = result
+            if self._flights.get(cmd) is flight:
+                del self._flights[cmd]
+            # Failed runs and commands without a ttl (ie. testCmd) are not cached
+            if not result[0] and not result[2] and self.ttls.get(cmd, 0) > 0:
+                self._results[cmd] = [time.time(), result]
+        flight[0].set()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'runs': self.runs, 'hits': self.hits, 'shared': self.shared, 'inFlight': len(self._flights)}
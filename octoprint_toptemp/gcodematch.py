@@ -0,0 +1,218 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import re
+import threading
+
+# ----------------------------------------------------------------------------------------------------------------
+# Helpers for the gcode monitors
+# ----------------------------------------------------------------------------------------------------------------
+
+regexpSpecial = set(".^$*+?{}[]\\|()")
+regexpQuantifiers = set("*?{")
+
+# Find the literal text a regexp must start with, ie. "^M106.*?S([^ ]+)" -> "M106"
+# Returns None if the pattern is not anchored or has no literal start - then any line can match
+def literalPrefix(pattern):
+    if not pattern.startswith("^"):
+        return None
+
+    # Top level alternatives can start with anything
+    depth = 0
+    escaped = False
+    inClass = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif inClass:
+            if char == "]":
+                inClass = False
+        elif char == "[":
+            inClass = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return None
+
+    prefix = ""
+    for indx in range(1, len(pattern)):
+        char = pattern[indx]
+        if char in regexpSpecial:
+            # The last char is optional/repeated
+            if char in regexpQuantifiers:
+                prefix = prefix[:-1]
+            break
+        prefix += char
+
+    if not prefix:
+        return None
+    return prefix
+
+# Build the prefilter for a set of compiled patterns - a tuple of prefixes for str.startswith or None if all
+# lines must be checked
+def buildPrefilter(patterns):
+    prefixes = set()
+    for pattern in patterns:
+        prefix = literalPrefix(pattern.pattern)
+        if prefix is None:
+            return None
+        prefixes.add(prefix)
+    return tuple(sorted(prefixes))
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Matches a line against all the monitors of one direction with as few regexp scans as possible:
+# - anchored patterns are only tried when the line starts with their literal prefix
+# - the rest is first checked by one combined regexp so lines nobody wants (ok, busy etc.) are only scanned once
+# ----------------------------------------------------------------------------------------------------------------
+class GcodeMatcher(object):
+    def __init__(self, patterns):
+        byPrefix = {}
+        # [(key, pattern), ...] that can match anywhere in the line
+        self.anywhere = []
+        for key in patterns:
+            prefix = literalPrefix(patterns[key].pattern)
+            if prefix is None:
+                self.anywhere.append((key, patterns[key]))
+            else:
+                byPrefix.setdefault(prefix, []).append((key, patterns[key]))
+        # [(prefix, [(key, pattern), ...]), ...]
+        self.prefixed = sorted(byPrefix.items())
+        self.gate = self._buildGate([item[1] for item in self.anywhere])
+
+    # One regexp that matches if any of the patterns matches - None if they can not be combined
+    def _buildGate(self, patterns):
+        if len(patterns) < 2:
+            return None
+        # Group numbers shifts when combined so back references would break
+        if any(re.search(r'\\[1-9]|\(\?P=', pattern.pattern) for pattern in patterns):
+            return None
+        try:
+            return re.compile("|".join("(?:" + pattern.pattern + ")" for pattern in patterns))
+        except re.error:
+            return None
+
+    # Returns [(key, value), ...] for all patterns matching the (stripped) line
+    def match(self, line):
+        found = []
+        for prefix, candidates in self.prefixed:
+            if line.startswith(prefix):
+                self._matchAll(candidates, line, found)
+
+        if self.anywhere and (self.gate is None or self.gate.search(line)):
+            self._matchAll(self.anywhere, line, found)
+        return found
+
+    def _matchAll(self, candidates, line, found):
+        for key, pattern in candidates:
+            match = pattern.search(line)
+            if match:
+                found.append((key, match.group(1) if pattern.groups else match.group(0)))
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Bounded queue between the comm hooks and the worker
+# When full the policy decides what to throw away:
+#   dropOldest : the oldest line is dropped
+#   latest     : only the latest line per gcode command (first word) is kept - ie. only the newest M106
+#                a full queue replaces the queued line for the same command in O(1)
+# ----------------------------------------------------------------------------------------------------------------
+overflowPolicies = ['dropOldest', 'latest']
+
+class GcodeLineQueue(object):
+    def __init__(self, maxSize=1000, policy="dropOldest"):
+        self._cond = threading.Condition()
+        # cells of [key, item] - key is only set for the latest policy
+        self._items = collections.deque()
+        # (type, command) -> newest cell for it, used by the latest policy to replace a line in O(1)
+        self._latest = {}
+        self.maxSize = maxSize
+        self.policy = policy
+        # counters
+        self.queued = 0
+        self.dropped = 0
+        self.maxBacklog = 0
+
+    # An invalid size keeps the current one
+    def configure(self, maxSize, policy):
+        with self._cond:
+            try:
+                self.maxSize = max(int(maxSize), 1)
+            except (TypeError, ValueError):
+                pass
+            if policy in overflowPolicies and policy != self.policy:
+                self.policy = policy
+                self._reindex()
+            while len(self._items) > self.maxSize:
+                self._forget(self._items.popleft())
+                self.dropped += 1
+
+    def put(self, item):
+        with self._cond:
+            key = None
+            if self.policy == "latest":
+                key = self._key(item)
+            if len(self._items) >= self.maxSize:
+                cell = self._latest.get(key) if key is not None else None
+                if cell is not None:
+                    # Full - the older line for the same command is replaced
+                    cell[1] = item
+                    self.dropped += 1
+                    self.queued += 1
+                    self._cond.notify()
+                    return
+                self._forget(self._items.popleft())
+                self.dropped += 1
+            cell = [key, item]
+            self._items.append(cell)
+            if key is not None:
+                self._latest[key] = cell
+            self.queued += 1
+            if len(self._items) > self.maxBacklog:
+                self.maxBacklog = len(self._items)
+            self._cond.notify()
+
+    # (type, command) - the command is the first word up to any ":" so "T:210.0 /210.0" and "T:211.0 /210.0" are the same
+    def _key(self, item):
+        return (item['type'], item['data'].lstrip().split(" ", 1)[0].split(":", 1)[0])
+
+    # Must be called with the lock held - the cell has left the queue
+    def _forget(self, cell):
+        if cell[0] is not None and self._latest.get(cell[0]) is cell:
+            del self._latest[cell[0]]
+
+    # Must be called with the lock held - after the policy changed
+    def _reindex(self):
+        self._latest = {}
+        for cell in self._items:
+            cell[0] = self._key(cell[1]) if self.policy == "latest" else None
+            if cell[0] is not None:
+                self._latest[cell[0]] = cell
+
+    # Wait for data and return up to maxItems lines
+    def getBatch(self, maxItems=100):
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            batch = []
+            while self._items and len(batch) < maxItems:
+                cell = self._items.popleft()
+                self._forget(cell)
+                batch.append(cell[1])
+            return batch
+
+    def stats(self):
+        with self._cond:
+            return {
+                'backlog' : len(self._items),
+                'maxBacklog' : self.maxBacklog,
+                'queued' : self.queued,
+                'dropped' : self.dropped,
+                'maxSize' : self.maxSize,
+                'policy' : self.policy
+            }
@@ -0,0 +1,257 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import base64
+import bisect
+import itertools
+import math
+import sys
+import threading
+from array import array
+
+# Unique id per buffer so clients can tell if the history has been reset since they last fetched it
+_generations = itertools.count(1)
+
+# ----------------------------------------------------------------------------------------------------------------
+# Fixed size ring buffer for the custom monitor history - timestamps and values are kept in compact double
+# arrays so appending is O(1) and no list is created per data point.
+# values holds the post calculated values and raws the values as received.
+# ----------------------------------------------------------------------------------------------------------------
+class HistoryBuffer(object):
+    def __init__(self, capacity):
+        self._lock = threading.Lock()
+        self.generation = next(_generations)
+        # changed every time the data changes
+        self.version = 0
+        self._alloc(max(int(capacity), 2))
+
+    def _alloc(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        self.raws = array('d', [0.0]) * capacity
+        # next write position and number of items stored
+        self._head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value, raw=None):
+        with self._lock:
+            self.times[self._head] = timestamp
+            self.values[self._head] = value
+            self.raws[self._head] = value if raw is None else raw
+            self._head = (self._head + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+            self.version += 1
+
+    # Change the size keeping the newest data
+    def resize(self, capacity):
+        capacity = max(int(capacity), 2)
+        if capacity == self.capacity:
+            return
+        with self._lock:
+            times, values, raws = self._ordered(True)
+            times = times[-capacity:]
+            values = values[-capacity:]
+            raws = raws[-capacity:]
+            self._alloc(capacity)
+            self.times[0:len(times)] = times
+            self.values[0:len(values)] = values
+            self.raws[0:len(raws)] = raws
+            self.count = len(times)
+            self._head = self.count % capacity
+            self.version += 1
+
+    # Newest item as [time, value] or None
+    def last(self):
+        with self._lock:
+            if not self.count:
+                return None
+            indx = (self._head - 1) % self.capacity
+            return [self.times[indx], self.values[indx]]
+
+    # Oldest item as [time, value] or None
+    def first(self):
+        with self._lock:
+            if not self.count:
+                return None
+            indx = self._head if self.count == self.capacity else 0
+            return [self.times[indx], self.values[indx]]
+
+    # Copy of the data newer than timestamp as (times, values) arrays - raw values if raw is set
+    def since(self, timestamp=None, raw=False):
+        with self._lock:
+            times, values, raws = self._ordered(raw)
+        if raw:
+            values = raws
+        if timestamp is None:
+            return times, values
+        indx = bisect.bisect_right(times, timestamp)
+        return times[indx:], values[indx:]
+
+    # Copy of all data oldest first as (times, values, raws) arrays
+    def export(self):
+        with self._lock:
+            return self._ordered(True)
+
+    # Recalculate all values from the raw values using func - ie. a new post calculation
+    def recalc(self, func):
+        with self._lock:
+            self.values[0:self.count] = func(self.raws[0:self.count])
+            self.version += 1
+
+    # Must be called with the lock held - copies of the data oldest first, raws is None unless withRaw
+    def _ordered(self, withRaw=False):
+        if self.count < self.capacity:
+            raws = self.raws[0:self.count] if withRaw else None
+            return self.times[0:self.count], self.values[0:self.count], raws
+        raws = self.raws[self._head:] + self.raws[0:self._head] if withRaw else None
+        return self.times[self._head:] + self.times[0:self._head], self.values[self._head:] + self.values[0:self._head], raws
+
+    # [[time, value], ...] oldest first - the format used by the API and the frontend
+    def toList(self):
+        with self._lock:
+            times, values, raws = self._ordered()
+        return [list(item) for item in zip(times, values)]
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Rollup of the history into fixed size time buckets with min/max/mean - used for windows longer than the raw
+# history. The bucket being filled is kept as running values so adding a sample is O(1), when a sample for a new
+# bucket arrives the current bucket is closed and stored in the ring.
+# ----------------------------------------------------------------------------------------------------------------
+# [bucket size in seconds, seconds to keep]
+rollupTiers = [
+    [60, 86400],
+    [900, 604800]
+]
+
+class RollupBuffer(object):
+    def __init__(self, bucketSecs, keepSecs):
+        self._lock = threading.Lock()
+        self.generation = next(_generations)
+        self.bucketSecs = bucketSecs
+        self.keepSecs = keepSecs
+        self.capacity = max(int(math.ceil(float(keepSecs)/bucketSecs)), 2)
+        self.times = array('d', [0.0]) * self.capacity
+        self.mins = array('d', [0.0]) * self.capacity
+        self.maxs = array('d', [0.0]) * self.capacity
+        self.means = array('d', [0.0]) * self.capacity
+        self._head = 0
+        self.count = 0
+        # bucket being filled: [start, min, max, sum, samples]
+        self._current = None
+
+    def __len__(self):
+        return self.count
+
+    def add(self, timestamp, value):
+        start = timestamp - (timestamp % self.bucketSecs)
+        with self._lock:
+            current = self._current
+            if current is not None and current[0] == start:
+                if value < current[1]:
+                    current[1] = value
+                if value > current[2]:
+                    current[2] = value
+                current[3] += value
+                current[4] += 1
+                return
+            # Samples older than the current bucket are dropped
+            if current is not None and start < current[0]:
+                return
+            if current is not None:
+                self._close(current)
+            self._current = [start, value, value, value, 1]
+
+    # Must be called with the lock held
+    def _close(self, bucket):
+        self.times[self._head] = bucket[0]
+        self.mins[self._head] = bucket[1]
+        self.maxs[self._head] = bucket[2]
+        self.means[self._head] = bucket[3]/bucket[4]
+        self._head = (self._head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    # Closed buckets newer than timestamp as (times, mins, maxs, means) arrays oldest first
+    # With current the bucket being filled is added last - returns (times, mins, maxs, means, current added)
+    def since(self, timestamp=None, current=False):
+        with self._lock:
+            if self.count < self.capacity:
+                result = [data[0:self.count] for data in (self.times, self.mins, self.maxs, self.means)]
+            else:
+                result = [data[self._head:] + data[0:self._head] for data in (self.times, self.mins, self.maxs, self.means)]
+            bucket = list(self._current) if self._current is not None else None
+        if timestamp is not None:
+            indx = bisect.bisect_right(result[0], timestamp)
+            result = [data[indx:] for data in result]
+        if not current:
+            return tuple(result)
+        added = bucket is not None and (timestamp is None or bucket[0] > timestamp)
+        if added:
+            for data, value in zip(result, (bucket[0], bucket[1], bucket[2], bucket[3]/bucket[4])):
+                data.append(value)
+        return tuple(result) + (added,)
+
+    # Oldest bucket start or None
+    def first(self):
+        with self._lock:
+            if not self.count:
+                return self._current[0] if self._current is not None else None
+            return self.times[self._head if self.count == self.capacity else 0]
+
+def createRollups():
+    return [RollupBuffer(tier[0], tier[1]) for tier in rollupTiers]
+
+# Find the best resolution for a window in seconds - returns None if the raw history covers it or else the rollup
+def selectRollup(rollups, window, rawSecs):
+    if window is None or window <= rawSecs:
+        return None
+    for rollup in rollups:
+        if rollup.keepSecs >= window:
+            return rollup
+    return rollups[-1]
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Encoding of history for the API
+#   list  : [[time, value], ...]
+#   delta : {'t0': first time, 'dt': [time deltas], 'v': [values]} - times rounded to the ms
+#   f32   : {'t0': first time, 'n': count, 'dt': base64 float32 offsets from t0, 'v': base64 float32 values}
+#           packed little endian - float32 offsets keeps ms precision for days where an epoch would not
+# ----------------------------------------------------------------------------------------------------------------
+historyEncodings = ['list', 'delta', 'f32']
+
+def _packFloat32(values):
+    packed = array('f', values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+# Encode extra values matching times from encodeHistory - ie. min/max for rollups
+def encodeValues(values, encoding="list"):
+    if encoding == "f32":
+        return _packFloat32(values) if len(values) else ''
+    return values.tolist()
+
+def encodeHistory(times, values, encoding="list"):
+    if encoding == "delta":
+        if not len(times):
+            return {'t0': None, 'dt': [], 'v': []}
+        # Deltas between the rounded times so the sum on the client ends on the rounded time and does not drift
+        rounded = [round(t, 3) for t in times]
+        deltas = [0.0]
+        deltas.extend([round(rounded[i] - rounded[i-1], 3) for i in range(1, len(rounded))])
+        return {'t0': rounded[0], 'dt': deltas, 'v': values.tolist()}
+
+    if encoding == "f32":
+        if not len(times):
+            return {'t0': None, 'n': 0, 'dt': '', 'v': ''}
+        t0 = times[0]
+        return {'t0': t0, 'n': len(times), 'dt': _packFloat32([t - t0 for t in times]), 'v': _packFloat32(values)}
+
+    return [list(item) for item in zip(times, values)]
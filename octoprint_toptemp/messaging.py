@@ -0,0 +1,84 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+# ----------------------------------------------------------------------------------------------------------------
+# Collects the data points from all the monitors and sends them to the frontend as one message per window instead
+# of one message per data point.
+# ----------------------------------------------------------------------------------------------------------------
+class MessageBatcher(object):
+    def __init__(self, sendFunc, window=0.25, keepAll=True, logger=None):
+        self._logger = logger or logging.getLogger("octoprint.plugins.toptemp")
+        self._send = sendFunc
+        self._lock = threading.Condition()
+        # key -> [[time, value], ...]
+        self._pending = {}
+        self._thread = None
+        self._running = False
+        self.window = window
+        self.keepAll = keepAll
+
+    def configure(self, window, keepAll):
+        with self._lock:
+            try:
+                self.window = max(float(window), 0.0)
+            except (TypeError, ValueError):
+                pass
+            self.keepAll = bool(keepAll)
+            self._lock.notify()
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._loop, name="TopTempMessages")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def shutdown(self):
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        self.flush()
+
+    def add(self, key, point):
+        # No window or not running - send right away
+        if self.window <= 0 or not self._running:
+            self._send({key: [point]})
+            return
+
+        with self._lock:
+            notify = not self._pending
+            if self.keepAll and key in self._pending:
+                self._pending[key].append(point)
+            else:
+                self._pending[key] = [point]
+            if notify:
+                self._lock.notify()
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        if pending:
+            try:
+                self._send(pending)
+            except Exception:
+                self._logger.exception("Sending data to the frontend failed")
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                # Wait for the first data to arrive and then wait the window to collect the rest
+                while self._running and not self._pending:
+                    self._lock.wait()
+                if not self._running:
+                    return
+                started = time.time()
+                while self._running and time.time() - started < self.window:
+                    self._lock.wait(self.window - (time.time() - started))
+            self.flush()
@@ -0,0 +1,139 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import math
+import re
+from collections import OrderedDict
+
+# ----------------------------------------------------------------------------------------------------------------
+# Multi value command monitors - one command run gives values for several series.
+# The first series is the main value of the monitor and is stored under the monitor key, the rest is stored as
+# "<monitor key>.<series name>".
+#   json   : the output is JSON, series are keys - nested keys separated by "/" ie. "cpu/temp"
+#   keyval : lines of "key=value" or "key: value", series are keys
+#   regex  : series are "name=regexp", the first group (or the whole match) is the value
+# With no series for json/keyval all numeric values found are used.
+# ----------------------------------------------------------------------------------------------------------------
+multiParsers = ['json', 'keyval', 'regex']
+seriesSep = "."
+
+keyValLine = re.compile(r'^\s*([^=:]+?)\s*[=:]\s*([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)')
+nameClean = re.compile(r'[^A-Za-z0-9_-]+')
+
+def seriesName(name):
+    return nameClean.sub("_", str(name).strip()).strip("_")
+
+def seriesKey(indx, name):
+    return indx + seriesSep + seriesName(name)
+
+# Monitor key for a series key - ie. "cu3.temp1" -> "cu3"
+def monitorKey(key):
+    return key.split(seriesSep, 1)[0]
+
+# float or None - NaN/inf are not values and would break the JSON sent to the frontend
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            value = float(value)
+        else:
+            value = float(str(value).strip())
+    except (ValueError, OverflowError):
+        return None
+    return value if not math.isinf(value) and not math.isnan(value) else None
+
+
+class MultiValueParser(object):
+    # Raises ValueError if the series setup is not valid
+    def __init__(self, parser, series=""):
+        self.parser = parser if parser in multiParsers else "json"
+        # [[name, path or compiled regexp], ...]
+        self.series = []
+        for line in str(series or "").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if self.parser == "regex":
+                if "=" not in line:
+                    raise ValueError("Regexp series must be name=regexp: " + line)
+                name, pattern = line.split("=", 1)
+                try:
+                    self.series.append([seriesName(name), re.compile(pattern.strip())])
+                except re.error as err:
+                    raise ValueError("Invalid regexp for " + name + ": " + str(err))
+            else:
+                self.series.append([seriesName(line), line])
+        # Name of the series stored under the monitor key - the first configured or else the first one ever found
+        self.mainSeries = self.series[0][0] if self.series else None
+
+    # Returns {name: value} in series order - series without a value are left out
+    def parse(self, output):
+        if self.parser == "regex":
+            result = self._parseRegex(output)
+        elif self.parser == "keyval":
+            result = self._parseKeyVal(output)
+        else:
+            result = self._parseJson(output)
+        if self.mainSeries is None and result:
+            self.mainSeries = next(iter(result))
+        return result
+
+    def _parseRegex(self, output):
+        result = OrderedDict()
+        for name, pattern in self.series:
+            match = pattern.search(output)
+            if match:
+                value = _number(match.group(1) if pattern.groups else match.group(0))
+                if value is not None:
+                    result[name] = value
+        return result
+
+    def _parseKeyVal(self, output):
+        found = OrderedDict()
+        for line in output.splitlines():
+            match = keyValLine.match(line)
+            value = _number(match.group(2)) if match else None
+            if value is not None:
+                found[match.group(1)] = value
+        if not self.series:
+            return OrderedDict((seriesName(key), found[key]) for key in found)
+        return OrderedDict((name, found[key]) for name, key in self.series if key in found)
+
+    def _parseJson(self, output):
+        try:
+            data = json.loads(output)
+        except ValueError:
+            return OrderedDict()
+        result = OrderedDict()
+        if not self.series:
+            self._flatten(data, "", result)
+            return result
+        for name, path in self.series:
+            value = data
+            for part in path.split("/"):
+                if isinstance(value, dict) and part in value:
+                    value = value[part]
+                elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                    value = value[int(part)]
+                else:
+                    value = None
+                    break
+            value = _number(value) if not isinstance(value, (dict, list)) else None
+            if value is not None:
+                result[name] = value
+        return result
+
+    def _flatten(self, data, prefix, result):
+        if isinstance(data, dict):
+            items = data.items()
+        elif isinstance(data, list):
+            items = enumerate(data)
+        else:
+            value = _number(data) if isinstance(data, (int, float)) else None
+            if value is not None and prefix:
+                result[seriesName(prefix)] = value
+            return
+        for key, value in items:
+            self._flatten(value, prefix + "_" + str(key) if prefix else str(key), result)
@@ -0,0 +1,178 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------------------------------------------------------------------------------------------------
+# 1-Wire temperature sensors (DS18B20 and friends) read through the w1_therm kernel driver.
+# A read of w1_slave blocks for the conversion (~750ms) so all the sensors in use are read at the same time on a
+# small pool, and monitors asking within the same tick share the result of one read pass.
+# ----------------------------------------------------------------------------------------------------------------
+w1Base = '/sys/bus/w1/devices'
+# Family codes for the temperature sensors: DS18S20, DS1822, DS18B20, DS1825, DS28EA00
+w1TempFamilies = ['10', '22', '28', '3b', '42']
+
+# Dallas/Maxim CRC8 - polynomial x^8 + x^5 + x^4 + 1
+def crc8(data):
+    crc = 0
+    for byte in data:
+        for _ in range(8):
+            mix = (crc ^ byte) & 0x01
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
+
+# Parse the contents of a w1_slave file and check the CRC ourself instead of trusting the YES only:
+# 72 01 4b 46 7f ff 0e 10 57 : crc=57 YES
+# 72 01 4b 46 7f ff 0e 10 57 t=23125
+def parseW1Slave(content):
+    lines = content.strip().splitlines()
+    if len(lines) < 2 or not lines[0].strip().endswith("YES"):
+        raise ValueError("CRC check failed")
+    try:
+        scratchpad = bytearray(int(part, 16) for part in lines[0].split(":")[0].split())
+    except ValueError:
+        raise ValueError("Invalid scratchpad")
+    if len(scratchpad) != 9 or crc8(scratchpad[0:8]) != scratchpad[8]:
+        raise ValueError("CRC check failed")
+    if "t=" not in lines[1]:
+        raise ValueError("No temperature found")
+    try:
+        return int(lines[1].split("t=")[1].strip())/1000.0
+    except ValueError:
+        raise ValueError("No temperature found")
+
+
+class W1Bus(object):
+    def __init__(self, basePath=w1Base, ttl=0.5, topologyTtl=300, workers=8):
+        self.basePath = basePath
+        # Results newer than this are shared
+        self.ttl = ttl
+        # How long the list of devices is trusted
+        self.topologyTtl = topologyTtl
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._pool = None
+        # [timestamp, [[path, device id], ...]]
+        self._topology = None
+        # paths monitors has asked for - only these are read in a pass
+        self._wanted = set()
+        # path -> [timestamp, value, error]
+        self._results = {}
+        # Event for the pass running
+        self._pass = None
+        self.passes = 0
+
+    # List of [w1_slave path, device id] - cached
+    def devices(self, refresh=False):
+        with self._lock:
+            if not refresh and self._topology is not None and time.time() - self._topology[0] < self.topologyTtl:
+                return self._topology[1]
+        found = []
+        for family in w1TempFamilies:
+            for device in sorted(glob.glob(os.path.join(self.basePath, family + '-*'))):
+                slaveFile = os.path.join(device, 'w1_slave')
+                if os.path.isfile(slaveFile):
+                    found.append([slaveFile, os.path.basename(device)])
+        with self._lock:
+            self._topology = [time.time(), found]
+        return found
+
+    # Read one sensor - all wanted sensors are read in the same pass. Raises ValueError/IOError like a file read
+    def read(self, filePath):
+        with self._lock:
+            self._wanted.add(filePath)
+        result = self._get(filePath)
+        if result[2] is not None:
+            raise result[2]
+        return result[1]
+
+    # Read all sensors on the bus - returns {path: value or None}
+    def readAll(self):
+        paths = [device[0] for device in self.devices()]
+        with self._lock:
+            self._wanted.update(paths)
+        self._runPass(paths)
+        with self._lock:
+            return {filePath: self._results[filePath][1] for filePath in paths if filePath in self._results}
+
+    # Forget sensors no longer used by any monitor
+    def setWanted(self, paths):
+        with self._lock:
+            self._wanted = set(paths)
+
+    def shutdown(self):
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    # Share a pass running right now, else run one - always including filePath even if it is no longer wanted
+    def _get(self, filePath):
+        with self._lock:
+            cached = self._results.get(filePath)
+            if cached is not None and time.time() - cached[0] < self.ttl:
+                return cached
+            running = self._pass
+        if running is not None:
+            running.wait()
+            with self._lock:
+                cached = self._results.get(filePath)
+            if cached is not None and time.time() - cached[0] < self.ttl:
+                return cached
+        with self._lock:
+            paths = list(self._wanted | set([filePath]))
+        self._runPass(paths)
+        with self._lock:
+            cached = self._results.get(filePath)
+        # Only if another pass without this file started first
+        if cached is None:
+            return [time.time(), None, IOError("Sensor not read: " + filePath)]
+        return cached
+
+    # Read the wanted sensors concurrently - if a pass is already running wait for it instead
+    def _runPass(self, paths=None):
+        with self._lock:
+            if self._pass is not None:
+                running = self._pass
+                owner = False
+            else:
+                running = self._pass = threading.Event()
+                owner = True
+                paths = list(self._wanted) if paths is None else paths
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._workers)
+                pool = self._pool
+        if not owner:
+            running.wait()
+            return
+
+        try:
+            results = list(pool.map(self._readFile, paths))
+        except RuntimeError:
+            # Pool is shutting down
+            results = [[time.time(), None, IOError("Shutting down")] for _ in paths]
+        with self._lock:
+            self.passes += 1
+            for filePath, result in zip(paths, results):
+                self._results[filePath] = result
+                # Sensor gone - find the devices again next time
+                if isinstance(result[2], (IOError, OSError)):
+                    self._topology = None
+            self._pass = None
+        running.set()
+
+    def _readFile(self, filePath):
+        try:
+            with open(filePath, "r") as fileHandle:
+                content = fileHandle.read()
+            return [time.time(), parseW1Slave(content), None]
+        except (IOError, OSError, ValueError) as err:
+            return [time.time(), None, err]
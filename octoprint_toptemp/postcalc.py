@@ -0,0 +1,120 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import ast
+import math
+import operator
+import sys
+from array import array
+
+# ----------------------------------------------------------------------------------------------------------------
+# Post calculation of monitor values - ie. "X/255*100".
+# The expression is parsed once into a tree of python functions, only numbers, X, basic math operators and a few
+# functions are allowed - nothing is ever passed to eval.
+# ----------------------------------------------------------------------------------------------------------------
+binaryOps = {
+    ast.Add      : operator.add,
+    ast.Sub      : operator.sub,
+    ast.Mult     : operator.mul,
+    ast.Div      : operator.truediv,
+    ast.FloorDiv : operator.floordiv,
+    ast.Mod      : operator.mod,
+    ast.Pow      : operator.pow
+}
+
+unaryOps = {
+    ast.UAdd : operator.pos,
+    ast.USub : operator.neg
+}
+
+functions = {
+    'abs'   : abs,
+    'round' : round,
+    'min'   : min,
+    'max'   : max,
+    'sqrt'  : math.sqrt,
+    'log'   : math.log,
+    'log10' : math.log10,
+    'floor' : math.floor,
+    'ceil'  : math.ceil
+}
+
+# Keep the size sane
+maxExpressionLength = 200
+maxPower = 100
+
+# Python < 3.8 parses numbers as ast.Num and newer ones as ast.Constant - ast.Num is deprecated so only look it up there
+numberNodes = tuple(node for node in (getattr(ast, "Constant", None), getattr(ast, "Num", None) if sys.version_info < (3, 8) else None) if node is not None)
+
+def _numberValue(node):
+    if not isinstance(node, numberNodes):
+        return None
+    value = node.value if hasattr(node, "value") else node.n
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+def _pow(base, exp):
+    if abs(exp) > maxPower:
+        raise OverflowError("Exponent too large")
+    return operator.pow(base, exp)
+
+def _compileNode(node):
+    if isinstance(node, ast.Expression):
+        return _compileNode(node.body)
+
+    value = _numberValue(node)
+    if value is not None:
+        return lambda x: value
+
+    if isinstance(node, ast.Name) and node.id in ("X", "x"):
+        return lambda x: x
+
+    if isinstance(node, ast.BinOp) and type(node.op) in binaryOps:
+        left = _compileNode(node.left)
+        right = _compileNode(node.right)
+        func = _pow if isinstance(node.op, ast.Pow) else binaryOps[type(node.op)]
+        return lambda x: func(left(x), right(x))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in unaryOps:
+        operand = _compileNode(node.operand)
+        func = unaryOps[type(node.op)]
+        return lambda x: func(operand(x))
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in functions and not node.keywords:
+        func = functions[node.func.id]
+        args = [_compileNode(arg) for arg in node.args]
+        return lambda x: func(*[arg(x) for arg in args])
+
+    raise ValueError("Unsupported expression: " + type(node).__name__)
+
+# Compile an expression into a function taking the raw value - returns None for empty expressions
+# Raises ValueError if the expression is not valid. Math errors (division by zero, overflow etc.) returns the raw value
+def compilePostCalc(expression):
+    if expression is None or str(expression).strip() == "":
+        return None
+    expression = str(expression).strip()
+    if len(expression) > maxExpressionLength:
+        raise ValueError("Expression too long")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as err:
+        raise ValueError("Invalid expression: " + str(err))
+    calc = _compileNode(tree)
+
+    def run(x):
+        try:
+            result = float(calc(x))
+        except (ArithmeticError, ValueError, TypeError):
+            return x
+        # inf/nan can not be sent as JSON
+        if math.isinf(result) or math.isnan(result):
+            return x
+        return result
+    return run
+
+# Run the calculation on a whole array of raw values
+def applyPostCalc(calc, values):
+    if calc is None:
+        return array('d', values)
+    return array('d', map(calc, values))
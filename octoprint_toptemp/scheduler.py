@@ -0,0 +1,234 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------------------------------------------------------------------------------------------------------
+# One scheduler thread for all the periodic monitors.
+# Jobs are grouped by interval so all monitors with the same interval runs in the same tick, the actual work
+# is handed to a small fixed size worker pool.
+# While the host is busy all intervals can be stretched by a slowdown factor.
+# ----------------------------------------------------------------------------------------------------------------
+class MonitorJob(object):
+    def __init__(self, key, interval, func, args, paused=False):
+        self.key = key
+        self.interval = interval
+        self.func = func
+        self.args = args
+        # Paused jobs stays scheduled but are skipped
+        self.paused = paused
+        # Queued or running in the pool - the job is not dispatched again until it is done
+        self.running = False
+
+    def run(self):
+        self.func(*self.args)
+
+
+class MonitorScheduler(object):
+    def __init__(self, workers=4, logger=None):
+        self._logger = logger or logging.getLogger("octoprint.plugins.toptemp")
+        self._workers = workers
+        self._lock = threading.Condition()
+        # all jobs by key
+        self._jobs = {}
+        # interval -> {'nextRun': timestamp, 'jobs': {key: job}}
+        self._groups = {}
+        # heap of (nextRun, interval) - monotonic time so clock changes (NTP at boot) do not stall or burst the runs
+        self._heap = []
+        self._pool = None
+        self._thread = None
+        self._running = False
+        # All intervals are multiplied by this - see setSlowdown
+        self.slowdown = 1.0
+        # Runs skipped because the previous run was still queued or running
+        self.skipped = 0
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._pool = ThreadPoolExecutor(max_workers=self._workers)
+            self._thread = threading.Thread(target=self._loop, name="TopTempScheduler")
+            self._thread.daemon = True
+            self._thread.start()
+            # Jobs added before start needs to run now
+            for key in self._jobs:
+                if not self._jobs[key].paused:
+                    self._dispatch(self._jobs[key])
+
+    def shutdown(self):
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    # Add or replace a job - the job is run right away and then every interval seconds
+    def addJob(self, key, interval, func, args, paused=False):
+        job = MonitorJob(key, interval, func, args, paused)
+        with self._lock:
+            self._removeJob(key)
+            self._jobs[key] = job
+            self._addToGroup(job)
+            if self._running and not paused:
+                self._dispatch(job)
+            self._lock.notify()
+
+    # Move a job to another interval without running it - it runs with the group for the new interval
+    def setInterval(self, key, interval):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.interval == interval:
+                return False
+            self._removeFromGroup(job)
+            job.interval = interval
+            self._addToGroup(job)
+            self._lock.notify()
+            return True
+
+    # Stretch all intervals ie. 2 runs everything half as often - 1 is normal
+    def setSlowdown(self, factor):
+        with self._lock:
+            self.slowdown = max(float(factor), 1.0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'slowdown' : self.slowdown,
+                'skipped' : self.skipped,
+                'intervals' : {key: self._jobs[key].interval for key in self._jobs}
+            }
+
+    def removeJob(self, key):
+        with self._lock:
+            return self._removeJob(key)
+
+    # Pause/resume a job - a resumed job is run right away
+    def setPaused(self, key, paused):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.paused == paused:
+                return False
+            job.paused = paused
+            if self._running and not paused:
+                self._dispatch(job)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._jobs = {}
+            self._groups = {}
+            self._heap = []
+            self._lock.notify()
+
+    # Must be called with the lock held - stale heap entries are skipped when they are due
+    def _removeJob(self, key):
+        job = self._jobs.pop(key, None)
+        if job is None:
+            return False
+        self._removeFromGroup(job)
+        return True
+
+    # Must be called with the lock held
+    def _addToGroup(self, job):
+        if job.interval not in self._groups:
+            nextRun = time.monotonic() + job.interval * self.slowdown
+            self._groups[job.interval] = {'nextRun': nextRun, 'jobs': {}}
+            heapq.heappush(self._heap, (nextRun, job.interval))
+        self._groups[job.interval]['jobs'][job.key] = job
+
+    # Must be called with the lock held
+    def _removeFromGroup(self, job):
+        group = self._groups.get(job.interval)
+        if group is not None:
+            group['jobs'].pop(job.key, None)
+            if not group['jobs']:
+                del self._groups[job.interval]
+
+    # Must be called with the lock held - a slow job is skipped instead of piling up runs in the pool
+    def _dispatch(self, job):
+        if job.running:
+            self.skipped += 1
+            return
+        try:
+            self._pool.submit(self._runJob, job)
+            job.running = True
+        except RuntimeError:
+            # Pool is shutting down
+            pass
+
+    def _runJob(self, job):
+        try:
+            job.run()
+        except Exception:
+            self._logger.exception("Monitor \"%s\" failed", job.key)
+        finally:
+            with self._lock:
+                job.running = False
+
+    def _loop(self):
+        with self._lock:
+            while self._running:
+                if not self._heap:
+                    self._lock.wait()
+                    continue
+
+                nextRun, interval = self._heap[0]
+                now = time.monotonic()
+                if nextRun > now:
+                    self._lock.wait(nextRun - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                group = self._groups.get(interval)
+                # Group is gone or has been recreated with its own heap entry
+                if group is None or group['nextRun'] != nextRun:
+                    continue
+
+                for key in group['jobs']:
+                    if not group['jobs'][key].paused:
+                        self._dispatch(group['jobs'][key])
+
+                # Don't drift and don't try to catch up if we are way behind
+                nextRun += interval * self.slowdown
+                if nextRun <= now:
+                    nextRun = now + interval * self.slowdown
+                group['nextRun'] = nextRun
+                heapq.heappush(self._heap, (nextRun, interval))
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Interval for an adaptive monitor - halved when a value moves more than the tolerance from the previous one and
+# grown by a quarter when it moves less than half of it, always between minInterval and maxInterval.
+# The tolerance is the deadband if the monitor has one, else 1% of the value (at least 0.1).
+# ----------------------------------------------------------------------------------------------------------------
+class AdaptiveInterval(object):
+    def __init__(self, minInterval, maxInterval, interval, tolerance=None):
+        self.minInterval = max(int(minInterval), 1)
+        self.maxInterval = max(int(maxInterval), self.minInterval)
+        self.interval = min(max(int(interval), self.minInterval), self.maxInterval)
+        self.tolerance = tolerance
+        self._last = None
+
+    # Returns the new interval in whole seconds or None if unchanged
+    def update(self, value):
+        last = self._last
+        self._last = value
+        if last is None:
+            return None
+        tolerance = self.tolerance if self.tolerance else max(abs(last) * 0.01, 0.1)
+        change = abs(value - last)
+        interval = self.interval
+        if change > tolerance:
+            interval = max(int(interval / 2), self.minInterval)
+        elif change < tolerance / 2:
+            interval = min(max(int(round(interval * 1.25)), interval + 1), self.maxInterval)
+        if interval == self.interval:
+            return None
+        self.interval = interval
+        return interval
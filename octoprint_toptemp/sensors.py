@@ -0,0 +1,85 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import glob
+import os
+import re
+
+from .onewire import parseW1Slave
+
+# ----------------------------------------------------------------------------------------------------------------
+# Native readers for sysfs sensor files - no need to fork bash/awk/cut just to read a number from a file
+# ----------------------------------------------------------------------------------------------------------------
+
+# hwmon reports everything in milli units except fans/pwm - https://www.kernel.org/doc/Documentation/hwmon/sysfs-interface
+hwmonScales = {
+    'temp'      : 1000.0,
+    'in'        : 1000.0,
+    'curr'      : 1000.0,
+    'humidity'  : 1000.0,
+    'power'     : 1000000.0,
+    'energy'    : 1000000.0,
+    'fan'       : 1.0,
+    'pwm'       : 1.0
+}
+
+# Find the divisor to use for a sysfs file
+def sysfsScale(filePath):
+    base = os.path.basename(filePath)
+    # thermal zone: /sys/class/thermal/thermal_zone0/temp
+    if base == "temp":
+        return 1000.0
+    match = re.match(r'^([a-z]+)\d*_(input|average|highest|lowest)$', base)
+    if match and match.group(1) in hwmonScales:
+        return hwmonScales[match.group(1)]
+    return 1.0
+
+# Read a single value from a sysfs file and scale it - w1_slave files are better read through onewire.W1Bus
+def readSysfsValue(filePath):
+    with open(filePath, "r") as fileHandle:
+        content = fileHandle.read()
+
+    if os.path.basename(filePath) == "w1_slave":
+        return parseW1Slave(content)
+
+    return float(content.strip())/sysfsScale(filePath)
+
+# Read a small text file, return None if not possible
+def readSysfsText(filePath):
+    try:
+        with open(filePath, "r") as fileHandle:
+            return fileHandle.read().strip()
+    except (IOError, OSError):
+        return None
+
+# ----------------------------------------------------------------------------------------------------------------
+# Discovery - all returns a list of [path, name]
+# ----------------------------------------------------------------------------------------------------------------
+def findThermalZones(typeFilter="cpu-thermal"):
+    found = []
+    for zone in sorted(glob.glob('/sys/class/thermal/thermal_zone*')):
+        tempFile = os.path.join(zone, 'temp')
+        zoneType = readSysfsText(os.path.join(zone, 'type'))
+        if zoneType is None or not os.path.isfile(tempFile):
+            continue
+        if typeFilter and typeFilter not in zoneType.lower():
+            continue
+        found.append([tempFile, zoneType])
+    return found
+
+# hwmon chip names known to report the cpu/soc temperature
+cpuHwmonChips = ('cpu_thermal', 'cpu-thermal', 'soc_thermal', 'coretemp', 'k10temp', 'k8temp', 'zenpower', 'fam15h_power', 'scpi_sensors')
+
+# cpuOnly: True = only known cpu chips, False = only the other chips, None = all
+def findHwmonSensors(cpuOnly=None):
+    found = []
+    for hwmon in sorted(glob.glob('/sys/class/hwmon/hwmon*')):
+        name = readSysfsText(os.path.join(hwmon, 'name')) or os.path.basename(hwmon)
+        if cpuOnly is not None and (name.lower() in cpuHwmonChips) != cpuOnly:
+            continue
+        for inputFile in sorted(glob.glob(os.path.join(hwmon, 'temp*_input'))):
+            label = readSysfsText(inputFile.replace('_input', '_label'))
+            if not label:
+                label = os.path.basename(inputFile).replace('_input', '')
+            found.append([inputFile, name + " " + label])
+    return found
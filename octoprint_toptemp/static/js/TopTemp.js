@@ -24,6 +24,9 @@ $(function() {
         self.mainTypes = ['bed','chamber'];
 
         self.customHistory = {};
+        self.historyPoints = 300;
+        // History generation per key - changes when the server resets the history
+        self.customHistoryGen = {};
         self.jsLoaded = false;
         self.firstBound = true;
 
@@ -32,6 +35,11 @@ $(function() {
         // How many seconds shall we plot back in the popover
         self.popoverGHist = -600;
 
+        // Min/max/avg for the custom monitors calculated by the server - see fetchMonitorStats
+        self.monitorStats = {};
+        self.monitorStatsTs = 0;
+        self.monitorStatsLoading = false;
+
         self.customCMDs = null;
 
         self.customPSUs = null;
@@ -95,13 +103,22 @@ $(function() {
                 var graphData = null;
                 if (customType){
                     var lowFound = null;
+                    var stepHold = self.hasDeadband(iSettings);
                     if (name in self.customHistory && self.customHistory[name].length > 0){
                         graphData =  {'series' : [self.customHistory[name].map(function(val,i){
                             if (lowFound == null || lowFound > val[1]){
                                 lowFound = val[1];
                             }
+                            // Values are only sent when changed - plot by time and hold the last value until now
+                            if (stepHold){
+                                return {x:val[0],y:val[1]};
+                            }
                             return val[1];
                         })]};
+                        if (stepHold){
+                            var lastVal = self.customHistory[name][self.customHistory[name].length-1];
+                            graphData.series[0].push({x:Math.max(Math.round(Date.now() / 1000),lastVal[0]),y:lastVal[1]});
+                        }
                     }
                     var reval = undefined;
                     if (iSettings.isTemp()){
@@ -150,6 +167,10 @@ $(function() {
                     if (iSettings.gMax() != ""){
                         graphOptions.high = iSettings.gMax()*1;
                     }
+                    if (customType && stepHold){
+                        graphOptions.axisX.type = Chartist.AutoScaleAxis;
+                        graphOptions.lineSmooth = Chartist.Interpolation.step();
+                    }
                     new Chartist.Line('#TopTempGraph_'+name+'_graph', graphData,graphOptions);
                 }
             }
@@ -224,10 +245,7 @@ $(function() {
             }
             // NOt a temperature?
             if('isTemp' in iSettings &&  iSettings.isTemp() == false){
-                // Fix digits
-                if(iSettings.postCalc() != null){
-                   value = self.PostCalcProces(value,iSettings.postCalc());
-                }
+                // Fix digits - post calculation is done by the server
                 if (iSettings.noDigits() != -1){
                     value = Number.parseFloat(value).toFixed(iSettings.noDigits());
                 }else{
@@ -307,13 +325,6 @@ $(function() {
 
         }
 
-        self.PostCalcProces = function(val,calc){
-            if (calc == null || calc == false || $.trim(calc) == ""){
-                return val;
-            }
-            return eval(calc.replace(/x/ig,val));
-        }
-
         // Get updated data from the "feeds"
         self.fromCurrentData = function(data){
             if (self.updatePaused){
@@ -337,6 +348,79 @@ $(function() {
             }
         }
 
+        // Get custom history from the server, incremental only gets data newer than what we have
+        self.loadCustomHistory = function(incremental){
+            var request = {'encoding' : 'delta'};
+            if (!incremental){
+                // The graphs are small - let the server downsample, min/max keeps the peaks
+                request.points = self.historyPoints;
+                request.method = 'minmax';
+            }else{
+                request.since = {};
+                request.gen = {};
+                $.each(self.customHistory,function(key,points){
+                    if (points.length && key in self.customHistoryGen){
+                        request.since[key] = points[points.length-1][0];
+                        request.gen[key] = self.customHistoryGen[key];
+                    }
+                });
+            }
+            OctoPrint.simpleApiCommand("toptemp", "getCustomHistory", request).done(function(response) {
+                var newHistory = {};
+                $.each(response,function(key,item){
+                    var points = self.decodeHistory(item);
+                    if (!item.full && key in self.customHistory){
+                        // Data pushed while waiting is already here
+                        var current = self.customHistory[key];
+                        var lastTs = current.length ? current[current.length-1][0] : null;
+                        points = current.filter(function(val){
+                            return item.first == null || val[0] >= item.first;
+                        }).concat(points.filter(function(val){
+                            return lastTs == null || val[0] > lastTs;
+                        }));
+                    }
+                    newHistory[key] = points;
+                    self.customHistoryGen[key] = item.gen;
+                });
+                self.customHistory = newHistory;
+            });
+        }
+
+        // Decode history sent from the server into [[time,value],...]
+        self.decodeHistory = function(item){
+            var data = item.data;
+            if (item.enc == "delta"){
+                var points = [];
+                var ts = data.t0;
+                $.each(data.dt,function(i,delta){
+                    // Times are in whole ms - round away the float error of the sum
+                    ts = Math.round((ts + delta) * 1000) / 1000;
+                    points.push([ts,data.v[i]]);
+                });
+                return points;
+            }
+            if (item.enc == "f32"){
+                var unpack = function(b64){
+                    var raw = atob(b64);
+                    var view = new DataView(new ArrayBuffer(raw.length));
+                    for (var i = 0; i < raw.length; i++){
+                        view.setUint8(i,raw.charCodeAt(i));
+                    }
+                    var values = [];
+                    for (var i = 0; i < data.n; i++){
+                        values.push(view.getFloat32(i*4,true));
+                    }
+                    return values;
+                }
+                var offsets = unpack(data.dt);
+                var values = unpack(data.v);
+                return offsets.map(function(offset,i){
+                    return [data.t0+offset,values[i]];
+                });
+            }
+            return data;
+        }
+
         // Custom data
         self.onDataUpdaterPluginMessage = function(plugin, data) {
             if (plugin != "toptemp"){
@@ -346,6 +430,27 @@ $(function() {
             if (!('success' in data) || data.success == false){
                 return;
             }
+            // Predefined options found in the background
+            if (data.type == "predefined"){
+                self.customCMDs = data.cmds;
+                self.customPSUs = data.psutil;
+                return;
+            }
+            // Batched data: {key: [[time,value],...]}
+            if (data.type == "customBatch"){
+                $.each(data.data,function(key,points){
+                    if (!(key in self.customHistory)){
+                        self.customHistory[key] = [];
+                    }
+                    self.customHistory[key].push(...points);
+                    // Series of multi value monitors are only shown in the popover
+                    if (self.isSeries(key)){
+                        return;
+                    }
+                    self.FormatTempHTML(key,{'actual' : points[points.length-1][1]},true);
+                });
+                return;
+            }
             if (!(data.key in self.customHistory)){
                 self.customHistory[data.key] = [];
             }
@@ -385,10 +490,8 @@ $(function() {
                 });
                 self.settings.sortOrder($('#TopTempSortList >div').map(function(){return $(this).data('sortid')}).get());
 
-                // Reload custom history
-                OctoPrint.simpleApiCommand("toptemp", "getCustomHistory", {}).done(function(response) {
-                    self.customHistory = response;
-                });
+                // Reload custom history - only get what we are missing
+                self.loadCustomHistory(true);
             }
         }
 
@@ -601,14 +704,19 @@ $(function() {
                                 // Build templates
                                 var cmdTemplate = $('#'+newId).find('.topTempPreDefCmds');
                                 cmdTemplate.find('li').remove();
-                                if (newVal == "cmd"){
-                                    // Show test button
+                                if (newVal == "cmd" || newVal == "sysfs" || newVal == "multi" || newVal == "stream"){
+                                    // Show test button - streams never ends so they can not be tested
                                     $('#'+newId).find('.topTempShowGC,.topTempShowPS').hide();
                                     $('#'+newId).find('.topTempShowCMD').show();
+                                    $('#'+newId).find('a.toptempTestCMD').toggle(newVal != "stream");
+                                    $('#'+newId).find('.topTempShowTimeout').toggle(newVal == "cmd" || newVal == "multi");
+                                    $('#'+newId).find('.topTempShowAdaptive').toggle(newVal != "stream");
+                                    $('#'+newId).find('.topTempShowMulti').toggle(newVal == "multi");
                                     $('#'+newId).find('.toptempTestCMDOutContainer').hide();
                                     if (self.customCMDs != null){
                                         $.each(self.customCMDs,function(idx,val){
-                                            if (val[2] == null){
+                                            // Only show working items of the selected type
+                                            if (val[2] == null || val[3] != newVal){
                                                 return;
                                             }
                                             var item = $('<li><a href="#">'+val[1]+'</a></li>');
@@ -672,7 +780,12 @@ $(function() {
                 }
                 $this.attr( "disabled", true );
                 output.html('<div class="alert alert-info"><strong>Wait...</strong></div>');
-                OctoPrint.simpleApiCommand("toptemp", "testCmd", {'cmd':cmdRun,'type' : cmdtype}).done(function(response) {
+                var request = {'cmd':cmdRun,'type' : cmdtype};
+                if (cmdtype == "multi"){
+                    request.parser = pane.find('select[data-custommon="multiParser"]').val();
+                    request.series = pane.find('textarea[data-custommon="multiSeries"]').val();
+                }
+                OctoPrint.simpleApiCommand("toptemp", "testCmd", request).done(function(response) {
                     if (!('success' in response) || response.success == false){
                         output.html('<div class="alert alert-error"><strong>Error</strong><br><pre>Error:\n<span class="text-error">  '+response.error+'</span>\nResult:\n<span class="text-error">  '+response.result+'</span>\nCode:\n<span class="text-error">  '+response.returnCode+'</span>\n</pre></div>');
                     }else{
@@ -1012,9 +1125,7 @@ $(function() {
             // Get history to make the UI update with the last data seen
             if (self.firstBound){
                 self.firstBound = false;
-                OctoPrint.simpleApiCommand("toptemp", "getCustomHistory", {}).done(function(response) {
-                    self.customHistory = response;
-                });
+                self.loadCustomHistory(false);
             }
 
             // Include chartist if not included already
@@ -1120,7 +1231,7 @@ $(function() {
 
             // Get data from history
             $.each(self.customHistory,function(k,v){
-                if ($('#navbar_plugin_toptemp_'+k).length){
+                if (!self.isSeries(k) && $('#navbar_plugin_toptemp_'+k).length){
                     if (v.length > 0){
                         self.FormatTempHTML(k,{'actual' : v[v.length-1][1]},true);
                     }
@@ -1225,6 +1336,15 @@ $(function() {
             });
         }
 
+        // Custom monitors with a deadband only gets values when they change
+        self.hasDeadband = function(iSettings){
+            if (typeof iSettings.deadband != "function"){
+                return false;
+            }
+            var deadband = iSettings.deadband();
+            return deadband !== null && deadband !== undefined && $.trim(deadband) !== "";
+        }
+
         self.findMinMaxAvg = function(data,maxHis){
             var items = 0;
             var nowTs = Math.round(Date.now() / 1000);
@@ -1252,6 +1372,21 @@ $(function() {
             return {'low':lowValD,'high':highValD,'avg':avg};
         }
 
+        // Get the rolling stats from the server - at most every 5 seconds and only while a popover is open
+        self.fetchMonitorStats = function(){
+            var nowTs = Date.now();
+            if (self.monitorStatsLoading || nowTs - self.monitorStatsTs < 5000){
+                return;
+            }
+            self.monitorStatsLoading = true;
+            OctoPrint.simpleApiCommand("toptemp", "getMonitorStats", {}).done(function(response) {
+                self.monitorStats = response;
+                self.monitorStatsTs = Date.now();
+            }).always(function(){
+                self.monitorStatsLoading = false;
+            });
+        }
+
         self.updatePopover = function($thisID,$isCustom,iSettings){
             var mainItem = $('#navbar_plugin_toptemp_'+$thisID);
             // Check if open or not
@@ -1271,9 +1406,26 @@ $(function() {
             if ($('#TopTempPopoverText_'+$thisID).length){
                 if ($isCustom){
                     if ($thisID in self.customHistory){
-                        var stats = self.findMinMaxAvg(self.customHistory[$thisID],maxHis);
+                        // The server keeps the stats for the gHisSecs window - scan the history if not there yet
+                        var stats = null;
+                        if (iSettings.gHisSecs() > 0){
+                            self.fetchMonitorStats();
+                            if ($thisID in self.monitorStats){
+                                stats = {'low':self.monitorStats[$thisID].min,'high':self.monitorStats[$thisID].max,'avg':self.monitorStats[$thisID].avg};
+                            }
+                        }
+                        if (stats == null){
+                            stats = self.findMinMaxAvg(self.customHistory[$thisID],maxHis);
+                        }
                         var actual = self.customHistory[$thisID][self.customHistory[$thisID].length-1][1];
                         var output = '<div class="pull-left"><small>Current: '+self.formatTempLabel($thisID,actual,iSettings,false)+'</small></div><div class="pull-right"><small>Max: '+self.formatTempLabel($thisID,stats.high,iSettings,false)+' &middot; Min: '+self.formatTempLabel($thisID,stats.low,iSettings,false)+' &middot; Avg: '+self.formatTempLabel($thisID,stats.avg,iSettings,false)+'</small></div>';
+                        // Multi value monitors
+                        var seriesOut = $.map(self.getSeries($thisID),function(points,name){
+                            return name+': '+self.formatTempLabel($thisID,points[points.length-1][1],iSettings,false);
+                        });
+                        if (seriesOut.length){
+                            output += '<div class="text-center"><small>'+seriesOut.join(' &middot; ')+'</small></div>';
+                        }
                         $('#TopTempPopoverText_'+$thisID).html(output);
                     }
                 }else{
@@ -1321,33 +1473,47 @@ $(function() {
                 if (!($thisID in self.customHistory) || self.customHistory[$thisID].length == 0){
                     return;
                 }
-                var temp = [...self.customHistory[$thisID]];
-                temp.reverse();
-                var series = [];
-                var dataFound = 0;
                 // Custom uses seconds and not milliseconds
                 var nowTs = Math.round(Date.now() / 1000);
                 var lowFound = null;
-                $.each(temp,function(x,val){
-                    var seconds = val[0]-nowTs;
-                    // only get last 10 min
-                    if (seconds < maxHis){
-                        return false;
-                    }
-                    dataFound++;
-                    var yval = val[1];
-                    if (fconvert){
-                        yval = self.convertToF(yval);
-                    }
-                    // Post calculate the value
-                    if(!iSettings.isTemp() && iSettings.postCalc() != null){
-                        yval = self.PostCalcProces(yval,iSettings.postCalc());
-                    }
-                    if (lowFound == null || lowFound > yval){
-                        lowFound = yval;
-                    }
-                    series.push({y:yval,x:seconds});
-                })
+                var stepHold = self.hasDeadband(iSettings);
+                var buildCustomSeries = function(temp){
+                    temp.reverse();
+                    var series = [];
+                    $.each(temp,function(x,val){
+                        var seconds = val[0]-nowTs;
+                        var yval = val[1];
+                        if (fconvert){
+                            yval = self.convertToF(yval);
+                        }
+                        // Hold the last value until now
+                        if (stepHold && x == 0 && seconds < 0){
+                            series.push({y:yval,x:0});
+                        }
+                        // only get last 10 min - with step hold the value at the start is the one before it
+                        if (seconds < maxHis){
+                            if (stepHold){
+                                series.push({y:yval,x:maxHis});
+                                if (lowFound == null || lowFound > yval){
+                                    lowFound = yval;
+                                }
+                            }
+                            return false;
+                        }
+                        if (lowFound == null || lowFound > yval){
+                            lowFound = yval;
+                        }
+                        series.push({y:yval,x:seconds});
+                    });
+                    // Oldest first so the steps are drawn forward in time
+                    return series.reverse();
+                }
+                var series = buildCustomSeries([...self.customHistory[$thisID]]);
+                // Multi value monitors - the other series
+                var extraSeries = [];
+                $.each(self.getSeries($thisID),function(name,points){
+                    extraSeries.push({'data':buildCustomSeries([...points]),'className':'ct-series-'+'bcdefhijklmno'[extraSeries.length % 13]});
+                });
                 var reval = undefined;
                 if (iSettings.isTemp()){
                     if (lowFound != null){
@@ -1362,7 +1528,7 @@ $(function() {
                 }
                 // Assign it
                 graphData = {
-                    'series' : [{'data':series,'className':'ct-series-a'}]
+                    'series' : [{'data':series,'className':'ct-series-a'}].concat(extraSeries)
                 };
             }else{
                 var reval = 0;
@@ -1481,6 +1647,9 @@ $(function() {
                     })
                 ]
             };
+            if ($isCustom && stepHold){
+                options.lineSmooth = Chartist.Interpolation.step();
+            }
             // DO we have what we need
             if (graphData != null){
                 new Chartist.Line('#TopTempPopoverGraph_'+$thisID, graphData,options);
@@ -1495,6 +1664,22 @@ $(function() {
             }
         }
 
+        // Series of a multi value monitor - "<monitor>.<name>"
+        self.isSeries = function(key){
+            return key.indexOf('.') != -1;
+        }
+
+        // Other series for a multi value monitor as {name: points}
+        self.getSeries = function(id){
+            var result = {};
+            $.each(self.customHistory,function(key,points){
+                if (key.indexOf(id+'.') === 0 && points.length){
+                    result[key.slice(id.length+1)] = points;
+                }
+            });
+            return result;
+        }
+
         self.getSettings = function(id){
             if (self.isCustom(id)){
                 return self.settings.customMon[id];
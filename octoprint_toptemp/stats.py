@@ -0,0 +1,85 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import math
+import threading
+
+# ----------------------------------------------------------------------------------------------------------------
+# Statistics over a sliding time window updated for every value in amortized O(1):
+#   min/max      : monotonic deques - the front is always the min/max of the window
+#   mean/stddev  : Welford, values leaving the window are removed again
+#   rate         : change per second from the oldest to the newest value in the window
+# ----------------------------------------------------------------------------------------------------------------
+class RollingStats(object):
+    def __init__(self, windowSecs):
+        self._lock = threading.Lock()
+        self.windowSecs = float(windowSecs)
+        self.clear()
+
+    def clear(self):
+        self._values = collections.deque()
+        self._mins = collections.deque()
+        self._maxs = collections.deque()
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def setWindow(self, windowSecs):
+        with self._lock:
+            self.windowSecs = float(windowSecs)
+            if self._values:
+                self._evict(self._values[-1][0])
+
+    def add(self, timestamp, value):
+        with self._lock:
+            self._values.append((timestamp, value))
+            count = len(self._values)
+            delta = value - self._mean
+            self._mean += delta / count
+            self._m2 += delta * (value - self._mean)
+
+            while self._mins and self._mins[-1][1] >= value:
+                self._mins.pop()
+            self._mins.append((timestamp, value))
+            while self._maxs and self._maxs[-1][1] <= value:
+                self._maxs.pop()
+            self._maxs.append((timestamp, value))
+
+            self._evict(timestamp)
+
+    # Must be called with the lock held - remove values older than the window
+    def _evict(self, newest):
+        cutoff = newest - self.windowSecs
+        while len(self._values) > 1 and self._values[0][0] < cutoff:
+            oldTime, oldValue = self._values.popleft()
+            count = len(self._values)
+            delta = oldValue - self._mean
+            self._mean -= delta / count
+            self._m2 -= delta * (oldValue - self._mean)
+            if self._mins[0][0] <= oldTime:
+                self._mins.popleft()
+            if self._maxs[0][0] <= oldTime:
+                self._maxs.popleft()
+        # Removing values can drift below zero
+        if self._m2 < 0:
+            self._m2 = 0.0
+
+    # {'count','last','min','max','avg','stddev','rate'} - None if no values
+    def snapshot(self):
+        with self._lock:
+            count = len(self._values)
+            if not count:
+                return None
+            first = self._values[0]
+            last = self._values[-1]
+            timeSpan = last[0] - first[0]
+            return {
+                'count' : count,
+                'last' : last[1],
+                'min' : self._mins[0][1],
+                'max' : self._maxs[0][1],
+                'avg' : self._mean,
+                'stddev' : math.sqrt(self._m2 / count),
+                'rate' : (last[1] - first[1]) / timeSpan if timeSpan > 0 else 0.0,
+                'window' : self.windowSecs
+            }
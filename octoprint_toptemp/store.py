@@ -0,0 +1,132 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import mmap
+import os
+import struct
+import threading
+
+# ----------------------------------------------------------------------------------------------------------------
+# History ring stored in a memory mapped file so the history survives restarts.
+# The file is a fixed size header followed by capacity packed records - appending is a struct.pack_into into the
+# map, the OS writes it back to disk.
+#   header : magic, capacity, next write position, number of records
+#   record : timestamp, value, raw value as little endian doubles
+# ----------------------------------------------------------------------------------------------------------------
+storeMagic = b'TTH1'
+headerFormat = struct.Struct('<4sIII')
+recordFormat = struct.Struct('<ddd')
+
+class HistoryStore(object):
+    def __init__(self, filePath, capacity):
+        self._lock = threading.Lock()
+        self.filePath = filePath
+        self._file = None
+        self._map = None
+        self.capacity = 0
+        self._head = 0
+        self.count = 0
+        # Closed stores ignores appends from monitors still running
+        self.closed = False
+        self._open(max(int(capacity), 2))
+
+    def _size(self, capacity):
+        return headerFormat.size + capacity * recordFormat.size
+
+    # Open the file - if it is missing, broken or the wrong size it is created with the data that could be read
+    def _open(self, capacity):
+        if os.path.isfile(self.filePath):
+            if os.path.getsize(self.filePath) != self._size(capacity):
+                try:
+                    records = self._readFile()
+                except (IOError, OSError, ValueError, struct.error):
+                    records = []
+                self._create(capacity, records[-capacity:])
+                return
+            self._mapFile(capacity)
+            self._head, self.count = self._headerValues()
+            return
+        self._create(capacity, [])
+
+    def _readFile(self):
+        with open(self.filePath, 'rb') as data:
+            content = data.read()
+        magic, capacity, head, count = headerFormat.unpack_from(content, 0)
+        if magic != storeMagic or count > capacity or head >= capacity or len(content) < self._size(capacity):
+            raise ValueError("Invalid history file: " + self.filePath)
+        start = head if count == capacity else 0
+        return [recordFormat.unpack_from(content, headerFormat.size + ((start + indx) % capacity) * recordFormat.size) for indx in range(count)]
+
+    def _create(self, capacity, records):
+        self._close()
+        with open(self.filePath, 'wb') as data:
+            data.write(headerFormat.pack(storeMagic, capacity, len(records) % capacity, len(records)))
+            for record in records:
+                data.write(recordFormat.pack(*record))
+            data.write(b'\0' * ((capacity - len(records)) * recordFormat.size))
+        self._mapFile(capacity)
+        self._head = len(records) % capacity
+        self.count = len(records)
+
+    def _mapFile(self, capacity):
+        self.capacity = capacity
+        self._file = open(self.filePath, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), self._size(capacity))
+
+    def _headerValues(self):
+        magic, capacity, head, count = headerFormat.unpack_from(self._map, 0)
+        if magic != storeMagic or capacity != self.capacity or count > capacity or head >= capacity:
+            return 0, 0
+        return head, count
+
+    def append(self, timestamp, value, raw):
+        with self._lock:
+            if self._map is None:
+                return
+            recordFormat.pack_into(self._map, headerFormat.size + self._head * recordFormat.size, timestamp, value, raw)
+            self._head = (self._head + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+            headerFormat.pack_into(self._map, 0, storeMagic, self.capacity, self._head, self.count)
+
+    # All records oldest first as [(timestamp, value, raw), ...]
+    def load(self):
+        with self._lock:
+            if self._map is None:
+                return []
+            start = self._head if self.count == self.capacity else 0
+            return [recordFormat.unpack_from(self._map, headerFormat.size + ((start + indx) % self.capacity) * recordFormat.size) for indx in range(self.count)]
+
+    # Replace the content - ie. after the history has been resized or recalculated
+    def rewrite(self, capacity, times, values, raws):
+        with self._lock:
+            if self.closed:
+                return
+            capacity = max(int(capacity), 2)
+            records = list(zip(times, values, raws))[-capacity:]
+            self._create(capacity, records)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._close()
+
+    # Must be called with the lock held
+    def _close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Close and remove the file
+    def remove(self):
+        with self._lock:
+            self.closed = True
+            self._close()
+            try:
+                os.remove(self.filePath)
+            except OSError:
+                pass
@@ -0,0 +1,291 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import errno
+import logging
+import os
+import selectors
+import subprocess
+import sys
+import threading
+import time
+
+from .executor import signalProcessGroup
+
+# ----------------------------------------------------------------------------------------------------------------
+# Stream monitors - the command is started once and every line it outputs is a value.
+# One thread reads all the streams using non blocking pipes, if a command exits it is restarted after a backoff
+# that doubles for every quick exit.
+# ----------------------------------------------------------------------------------------------------------------
+class StreamManager(object):
+    def __init__(self, onLine, minBackoff=1.0, maxBackoff=60.0, logger=None):
+        self._logger = logger or logging.getLogger("octoprint.plugins.toptemp")
+        self._onLine = onLine
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        # A command running this long is considered healthy and the backoff is reset
+        self.healthyAfter = 60.0
+        # Lines longer than this are dropped
+        self.maxLine = 4096
+        # Stopped commands still running this long after SIGTERM are killed
+        self.killAfter = 1.0
+        self._lock = threading.Lock()
+        # key -> stream state, see add
+        self._streams = {}
+        # (proc, kill at) for stopped commands not reaped yet - see _reap
+        self._stopping = []
+        self._selector = None
+        self._wakeRead = None
+        self._wakeWrite = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._selector = selectors.DefaultSelector()
+            self._wakeRead, self._wakeWrite = os.pipe()
+            os.set_blocking(self._wakeRead, False)
+            self._selector.register(self._wakeRead, selectors.EVENT_READ, None)
+            self._thread = threading.Thread(target=self._loop, name="TopTempStreams")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def shutdown(self):
+        with self._lock:
+            self._running = False
+            for key in self._streams:
+                self._stop(self._streams[key])
+        self._wake()
+        self._reap(True)
+
+    # Add or replace a stream - paused streams are not started
+    def add(self, key, cmd, paused=False):
+        with self._lock:
+            if key in self._streams:
+                self._stop(self._streams.pop(key))
+            self._streams[key] = {
+                'cmd' : cmd,
+                'paused' : paused,
+                'proc' : None,
+                'buffer' : b'',
+                'started' : None,
+                'nextStart' : 0.0,
+                'backoff' : self.minBackoff,
+                'restarts' : 0,
+                'lines' : 0,
+                'dropped' : 0
+            }
+        self._wake()
+
+    def remove(self, key):
+        with self._lock:
+            stream = self._streams.pop(key, None)
+            if stream is None:
+                return False
+            self._stop(stream)
+        self._wake()
+        return True
+
+    def clear(self):
+        with self._lock:
+            for key in self._streams:
+                self._stop(self._streams[key])
+            self._streams = {}
+            running = self._running
+        self._wake()
+        # Without the loop nothing else reaps them
+        if not running:
+            self._reap(True)
+
+    def setPaused(self, key, paused):
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None or stream['paused'] == paused:
+                return False
+            stream['paused'] = paused
+            if paused:
+                self._stop(stream)
+            else:
+                stream['nextStart'] = 0.0
+                stream['backoff'] = self.minBackoff
+        self._wake()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {key: {
+                'running' : self._streams[key]['proc'] is not None,
+                'paused' : self._streams[key]['paused'],
+                'restarts' : self._streams[key]['restarts'],
+                'lines' : self._streams[key]['lines'],
+                'dropped' : self._streams[key]['dropped']
+            } for key in self._streams}
+
+    def _wake(self):
+        if self._wakeWrite is not None:
+            try:
+                os.write(self._wakeWrite, b'x')
+            except OSError:
+                pass
+
+    # Must be called with the lock held
+    def _spawn(self, key, stream):
+        thisExec = None
+        if sys.platform.startswith("linux"):
+            thisExec = '/bin/bash'
+        stream['nextStart'] = time.time() + stream['backoff']
+        try:
+            proc = subprocess.Popen(stream['cmd'],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL,
+                                    stdin=subprocess.DEVNULL,
+                                    shell=True,
+                                    executable=thisExec,
+                                    start_new_session=True)
+        except (OSError, ValueError) as err:
+            self._logger.warning("Unable to start stream \"%s\": %s", stream['cmd'], err)
+            stream['backoff'] = min(stream['backoff'] * 2, self.maxBackoff)
+            return
+        os.set_blocking(proc.stdout.fileno(), False)
+        stream['proc'] = proc
+        stream['buffer'] = b''
+        stream['started'] = time.time()
+        self._selector.register(proc.stdout, selectors.EVENT_READ, key)
+
+    # Must be called with the lock held - the command is signalled and left for _reap so the lock is not held while waiting
+    def _stop(self, stream):
+        proc = stream['proc']
+        if proc is None:
+            return
+        stream['proc'] = None
+        try:
+            if self._selector is not None:
+                self._selector.unregister(proc.stdout)
+        except (KeyError, ValueError):
+            pass
+        # The whole group - the shell may be gone while the rest of a pipeline is still running
+        signalProcessGroup(proc)
+        self._stopping.append((proc, time.monotonic() + self.killAfter))
+
+    # Reap the stopped commands - the ones still running after killAfter are killed. With wait it blocks until all
+    # are gone, else the ones not due yet are left for the next call
+    def _reap(self, wait=False):
+        with self._lock:
+            stopping = self._stopping
+            self._stopping = []
+        pending = []
+        for proc, killAt in stopping:
+            if wait:
+                try:
+                    proc.wait(max(killAt - time.monotonic(), 0))
+                except subprocess.TimeoutExpired:
+                    pass
+            if proc.poll() is None:
+                if not wait and time.monotonic() < killAt:
+                    pending.append((proc, killAt))
+                    continue
+                signalProcessGroup(proc,True)
+                proc.wait()
+            proc.stdout.close()
+        if pending:
+            with self._lock:
+                self._stopping.extend(pending)
+
+    # Must be called with the lock held - the command exited, restart later
+    def _exited(self, key, stream):
+        ranFor = time.time() - (stream['started'] or 0)
+        self._stop(stream)
+        if ranFor >= self.healthyAfter:
+            stream['backoff'] = self.minBackoff
+        self._logger.info("Stream \"%s\" for %s stopped - restarting in %.0f seconds", stream['cmd'], key, stream['backoff'])
+        stream['nextStart'] = time.time() + stream['backoff']
+        stream['backoff'] = min(stream['backoff'] * 2, self.maxBackoff)
+        stream['restarts'] += 1
+
+    # Must be called with the lock held - returns complete lines
+    def _read(self, key, stream):
+        lines = []
+        while True:
+            try:
+                data = os.read(stream['proc'].stdout.fileno(), 65536)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                data = b''
+            if not data:
+                # End of file
+                self._exited(key, stream)
+                break
+            stream['buffer'] += data
+        buffer = stream['buffer']
+        if b'\n' in buffer:
+            parts = buffer.split(b'\n')
+            stream['buffer'] = parts.pop()
+            lines = parts
+        if len(stream['buffer']) > self.maxLine:
+            stream['buffer'] = b''
+            stream['dropped'] += 1
+        return lines
+
+    def _loop(self):
+        while True:
+            ready = []
+            self._reap()
+            with self._lock:
+                if not self._running:
+                    break
+                # Start what needs to run
+                now = time.time()
+                timeout = 1.0
+                for key in self._streams:
+                    stream = self._streams[key]
+                    if stream['paused'] or stream['proc'] is not None:
+                        continue
+                    if stream['nextStart'] <= now:
+                        self._spawn(key, stream)
+                    if stream['proc'] is None:
+                        timeout = min(timeout, max(stream['nextStart'] - now, 0.05))
+                if self._stopping:
+                    timeout = min(timeout, 0.1)
+                selector = self._selector
+
+            for selKey, events in selector.select(timeout):
+                ready.append(selKey)
+
+            received = []
+            with self._lock:
+                for selKey in ready:
+                    if selKey.data is None:
+                        # Wake up
+                        try:
+                            while os.read(self._wakeRead, 1024):
+                                pass
+                        except OSError:
+                            pass
+                        continue
+                    stream = self._streams.get(selKey.data)
+                    if stream is None or stream['proc'] is None or stream['proc'].stdout is not selKey.fileobj:
+                        continue
+                    for line in self._read(selKey.data, stream):
+                        if len(line) > self.maxLine:
+                            stream['dropped'] += 1
+                            continue
+                        stream['lines'] += 1
+                        received.append((selKey.data, line))
+
+            for key, line in received:
+                try:
+                    self._onLine(key, line.decode("utf-8", "replace").strip())
+                except Exception:
+                    self._logger.exception("Stream line for \"%s\" failed", key)
+
+        self._reap(True)
+        with self._lock:
+            self._selector.close()
+            os.close(self._wakeRead)
+            os.close(self._wakeWrite)
+            self._wakeRead = None
+            self._wakeWrite = None
@@ -0,0 +1,121 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+import psutil
+
+# ----------------------------------------------------------------------------------------------------------------
+# Shared psutil snapshot - every psutil source is only collected once within the ttl no matter how many monitors
+# that needs it. All monitors in the same scheduler tick will be served from the same snapshot.
+# ----------------------------------------------------------------------------------------------------------------
+class PsutilSnapshot(object):
+    def __init__(self, ttl=0.5):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (source, args) -> [timestamp, value]
+        self._cache = {}
+        # number of real psutil calls per source
+        self.calls = {}
+        self._cpuPrimed = False
+
+    # source is the name of a psutil function, args is passed on to it - ie. get("disk_usage","/")
+    def get(self, source, *args):
+        key = (source,) + args
+        with self._lock:
+            now = time.time()
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+            value = self._collect(source, args)
+            self._cache[key] = [now, value]
+            self.calls[source] = self.calls.get(source, 0) + 1
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._cache = {}
+
+    def _collect(self, source, args):
+        # Not all platforms have all the sensors
+        if not hasattr(psutil, source):
+            return None
+
+        # First call of cpu_percent always returns 0.0 - prime it
+        if source == "cpu_percent":
+            if not self._cpuPrimed:
+                psutil.cpu_percent(interval=None)
+                self._cpuPrimed = True
+            return psutil.cpu_percent(interval=None)
+
+        return getattr(psutil, source)(*args)
+
+
+# ----------------------------------------------------------------------------------------------------------------
+# Precompiled readers - everything needed to read a psutil monitor is resolved once when building the list
+# ----------------------------------------------------------------------------------------------------------------
+class PsutilReader(object):
+    def __init__(self, snapshot, source, extract, args=()):
+        self.snapshot = snapshot
+        self.source = source
+        self.extract = extract
+        self.args = args
+
+    # Returns None if no data is available - 0 is a valid reading
+    def read(self):
+        result = self.snapshot.get(self.source, *self.args)
+        if result is None:
+            return None
+        return self.extract(result)
+
+
+def _toMB(attr):
+    return lambda result: getattr(result, attr)/1048576
+
+def _attr(attr):
+    return lambda result: getattr(result, attr)
+
+def _index(indx):
+    return lambda result: result[indx]
+
+def _sensor(name, entryno):
+    return lambda result: result[name][entryno].current
+
+
+# key : [psutil source, extract function]
+staticReaders = {
+    'cpup'      : ["cpu_percent", lambda result: result],
+    'cpuf'      : ["cpu_freq", _attr('current')],
+    'loadavg1'  : ["getloadavg", _index(0)],
+    'loadavg5'  : ["getloadavg", _index(1)],
+    'loadavg15' : ["getloadavg", _index(2)],
+    'memtotal'  : ["virtual_memory", _toMB('total')],
+    'memavail'  : ["virtual_memory", _toMB('available')],
+    'memused'   : ["virtual_memory", _toMB('used')],
+    'memfree'   : ["virtual_memory", _toMB('free')],
+    'memp'      : ["virtual_memory", _attr('percent')],
+    'swaptotal' : ["swap_memory", _toMB('total')],
+    'swapused'  : ["swap_memory", _toMB('used')],
+    'swapfree'  : ["swap_memory", _toMB('free')],
+    'swapperc'  : ["swap_memory", _attr('percent')],
+    'batper'    : ["sensors_battery", _attr('percent')],
+    'batsec'    : ["sensors_battery", _attr('secsleft')]
+}
+
+# disk key prefix : extract function
+diskReaders = {
+    'diskfree'  : _toMB('free'),
+    'disktotal' : _toMB('total'),
+    'diskused'  : _toMB('used'),
+    'diskperc'  : _attr('percent')
+}
+
+def buildStaticReader(snapshot, key):
+    return PsutilReader(snapshot, staticReaders[key][0], staticReaders[key][1])
+
+def buildDiskReader(snapshot, diskKey, mountpoint):
+    return PsutilReader(snapshot, "disk_usage", diskReaders[diskKey], (mountpoint,))
+
+def buildSensorReader(snapshot, source, name, entryno):
+    return PsutilReader(snapshot, source, _sensor(name, entryno))
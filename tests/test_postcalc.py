@@ -0,0 +1,106 @@
+# coding=utf-8
+#
+# Tests for the post calculation compiler - the replacement for eval so it must reject anything but plain math.
+# The modules are loaded directly so OctoPrint is not needed:
+#
+#   python -m pytest tests
+#
+from __future__ import absolute_import
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "octoprint_toptemp"))
+import postcalc
+
+
+class CompilePostCalcTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertIsNone(postcalc.compilePostCalc(None))
+        self.assertIsNone(postcalc.compilePostCalc(""))
+        self.assertIsNone(postcalc.compilePostCalc("   "))
+
+    def test_fanPercent(self):
+        calc = postcalc.compilePostCalc("X/255*100")
+        self.assertEqual(calc(255), 100.0)
+        self.assertAlmostEqual(calc(127.5), 50.0)
+
+    def test_acceptedNodes(self):
+        cases = {
+            "x" : 4.0,
+            "X+1-2" : 3.0,
+            "X*3" : 12.0,
+            "X/8" : 0.5,
+            "X//3" : 1.0,
+            "X%3" : 1.0,
+            "X**2" : 16.0,
+            "-X" : -4.0,
+            "+X" : 4.0,
+            "(X+1)*2" : 10.0,
+            "1.5" : 1.5,
+            "abs(-X)" : 4.0,
+            "round(X/3)" : 1.0,
+            "min(X,2)" : 2.0,
+            "max(X,2,9)" : 9.0,
+            "sqrt(X)" : 2.0,
+            "log10(X*25)" : 2.0,
+            "floor(X/3)" : 1.0,
+            "ceil(X/3)" : 2.0
+        }
+        for expression in cases:
+            self.assertAlmostEqual(postcalc.compilePostCalc(expression)(4.0), cases[expression], msg=expression)
+
+    def test_rejectedNodes(self):
+        for expression in (
+            "__import__('os')",
+            "open('/etc/passwd')",
+            "X.real",
+            "X[0]",
+            "[X]",
+            "(X,1)",
+            "lambda: X",
+            "Y+1",
+            "'a'",
+            "True",
+            "X if X else 1",
+            "X < 1",
+            "X and 1",
+            "X << 2",
+            "X & 1",
+            "round(X, ndigits=1)",
+            "math.sqrt(X)",
+            "(lambda: 1)()",
+            "X = 1",
+            "X +",
+            "1" * (postcalc.maxExpressionLength + 1)
+        ):
+            with self.assertRaises(ValueError, msg=expression):
+                postcalc.compilePostCalc(expression)
+
+    def test_powLimit(self):
+        calc = postcalc.compilePostCalc("X**" + str(postcalc.maxPower))
+        self.assertEqual(calc(1.0), 1.0)
+        # Too large exponents are not calculated - the raw value is kept
+        calc = postcalc.compilePostCalc("X**" + str(postcalc.maxPower + 1))
+        self.assertEqual(calc(2.0), 2.0)
+        calc = postcalc.compilePostCalc("9**9**9")
+        self.assertEqual(calc(3.0), 3.0)
+
+    def test_mathErrorFallback(self):
+        self.assertEqual(postcalc.compilePostCalc("X/0")(5.0), 5.0)
+        self.assertEqual(postcalc.compilePostCalc("X%0")(5.0), 5.0)
+        self.assertEqual(postcalc.compilePostCalc("sqrt(X)")(-4.0), -4.0)
+        self.assertEqual(postcalc.compilePostCalc("log(X)")(0.0), 0.0)
+        self.assertEqual(postcalc.compilePostCalc("10.0**300*X")(1e300), 1e300)
+        # Overflow to inf
+        self.assertEqual(postcalc.compilePostCalc("X*X")(1e300), 1e300)
+
+    def test_applyPostCalc(self):
+        calc = postcalc.compilePostCalc("X*2")
+        self.assertEqual(list(postcalc.applyPostCalc(calc, [1.0, 2.0])), [2.0, 4.0])
+        self.assertEqual(list(postcalc.applyPostCalc(None, [1.0, 2.0])), [1.0, 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()